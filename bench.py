@@ -0,0 +1,282 @@
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np  # v 1.14.5
+import pandas as pd  # v 0.23.1
+
+import generator
+from synth import parse_rows, synthesize
+
+# Benchmarks of the stages of generator.py on synthetic data (synth.py) and the correctness check of its tables
+#   python bench.py run --rows 100k 1M        timings, stored in bench_results/<commit>.json
+#   python bench.py compare OLD.json NEW.json  stage by stage ratios of two stored results
+#   python bench.py check                      arh/gc1/gc3 counts of every loading path against a naive reference
+
+# stages measured on every size: the reduction of the CSV, chunk by chunk, split into its steps,
+# and generator.load as a whole (in memory up to 1M rows, in chunks above, and with every core)
+row_stages = ['ingest', 'classify', 'binning', 'accumulate', 'load', 'load_parallel']
+# stages of the report, the tables have the same size whatever the number of rows, measured once
+report_stages = ['aggregate', 'excel', 'excel_numeric', 'json', 'charts', 'charts_vector', 'pdf']
+# rows of the chunks of the streaming stages, bounds the memory at 10M and 100M rows
+bench_chunk = 10 ** 6
+
+
+def data_file(rows, seed, data_dir):  # synthetic CSV of the benchmark, generated once and kept in data_dir
+    path = os.path.join(data_dir, 'synth_{}_{}.csv'.format(rows, seed))
+    if not os.path.exists(path):
+        if not os.path.exists(data_dir):
+            os.makedirs(data_dir)
+        print('generating {} ...'.format(path))
+        synthesize(path + '.tmp', rows, seed)
+        os.rename(path + '.tmp', path)
+    return path
+
+
+def commit():  # (short hash of HEAD, True when tracked files differ from it)
+    try:
+        sha = subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=subprocess.STDOUT)
+        sha = sha.decode().strip()
+        dirty = bool(subprocess.check_output(['git', 'status', '--porcelain', '--untracked-files=no']).strip())
+        return sha, dirty
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown', False
+
+
+def reduce_chunks(path):
+    # one pass over the file in chunks with the time of every step, the steps of generator.accumulate_frame
+    # classify and binning are timed on their own, accumulate is the whole reduction of a chunk
+    opts = generator.options()
+    t = dict.fromkeys(row_stages[:4], 0.)
+    rows = 0
+    agg = None
+    chunks = generator.read_csv(path, bench_chunk)
+    while True:
+        t0 = time.time()
+        chunk = next(chunks, None)
+        if chunk is None:
+            break
+        rows += len(chunk)
+        df = generator.prepare(chunk)
+        t1 = time.time()
+        codes = [generator.classify(df, n) for n in range(3)]
+        t2 = time.time()
+        key = np.zeros(len(df), dtype=np.int64)
+        for n in range(3):
+            generator.calc_bins(df[generator.confi[n]].values, codes[n], key)
+        t3 = time.time()
+        agg = generator.merge_parts(agg, generator.accumulate_frame(df, opts))
+        t4 = time.time()
+        t['ingest'] += t1 - t0
+        t['classify'] += t2 - t1
+        t['binning'] += t3 - t2
+        t['accumulate'] += t4 - t3
+    return t, rows, agg
+
+
+def best(times):  # the fastest of the repeats and all of them
+    return {'seconds': min(times), 'all': times}
+
+
+def timed(fn, repeat):  # times of repeat calls of fn, and what the last one returned
+    times = []
+    for i in range(repeat):
+        t = time.time()
+        result = fn()
+        times.append(time.time() - t)
+    return times, result
+
+
+def bench_rows(path, rows, repeat, stages):  # row stages of one size, {stage: {'seconds', 'all', 'rows_per_second'}}
+    res = {}
+    if any(s in stages for s in row_stages[:4]):
+        passes = []
+        for i in range(repeat):
+            t, n, agg = reduce_chunks(path)
+            passes.append(t)
+        for s in row_stages[:4]:
+            if s in stages:
+                res[s] = best([p[s] for p in passes])
+    big = rows > bench_chunk
+    if 'load' in stages:
+        res['load'] = best(timed(lambda: generator.load(path, generator.options(chunksize=bench_chunk if big else 0)),
+                                 repeat)[0])
+    if 'load_parallel' in stages and (os.cpu_count() or 1) > 1:
+        opts = generator.options(jobs=os.cpu_count(), chunksize=bench_chunk if big else 0)
+        res['load_parallel'] = best(timed(lambda: generator.load(path, opts), repeat)[0])
+    for r in res.values():
+        r['rows_per_second'] = rows / r['seconds'] if r['seconds'] else None
+    return res
+
+
+def bench_report(path, repeat, stages):  # the report stages on the tables of path
+    import pdfreport
+    opts = generator.options()
+    res = {}
+    out = tempfile.mkdtemp()
+    try:
+        agg = generator.load(path, opts)
+        times, report = timed(lambda: generator.aggregate(agg, opts), repeat)
+        if 'aggregate' in stages:
+            res['aggregate'] = best(times)
+        outputs = {'excel': lambda: generator.render_excel(report, os.path.join(out, 'r.xlsx')),
+                   'excel_numeric': lambda: generator.render_excel(report, os.path.join(out, 'n.xlsx'), numeric=True),
+                   'json': lambda: generator.render_json(report, os.path.join(out, 'r.json')),
+                   'pdf': lambda: generator.render_pdf(report, os.path.join(out, 'r.pdf'), opts)}
+        arh, gc1, gc2, gc3, sweep = report['tables']
+        jobs = []
+        for i in range(3):
+            jobs += pdfreport.chart_jobs(gc1[i], gc3[i], generator.dimensions[i])
+        outputs['charts'] = lambda: [pdfreport.render_chart(job) for job in jobs]
+        outputs['charts_vector'] = lambda: [pdfreport.vector_chart(job) for job in jobs]
+        for s in report_stages[1:]:
+            if s in stages:
+                res[s] = best(timed(outputs[s], repeat)[0])
+    finally:
+        shutil.rmtree(out, ignore_errors=True)
+    return res
+
+
+def run(args):
+    sha, dirty = commit()
+    stages = args.stages or row_stages + report_stages
+    result = {'commit': sha, 'dirty': dirty, 'date': time.strftime('%Y-%m-%d %H:%M:%S'), 'seed': args.seed,
+              'repeat': args.repeat, 'python': platform.python_version(), 'numpy': np.__version__,
+              'pandas': pd.__version__, 'machine': platform.platform(), 'cpus': os.cpu_count(), 'rows': {}}
+    for text in args.rows:
+        rows = parse_rows(text)
+        path = data_file(rows, args.seed, args.data_dir)
+        res = bench_rows(path, rows, args.repeat, stages)
+        result['rows'][str(rows)] = res
+        for s, r in res.items():
+            print('{:>10} rows  {:<14} {:9.3f} s  {:12,.0f} rows/s'.format(rows, s, r['seconds'], r['rows_per_second']))
+    if any(s in stages for s in report_stages):
+        result['report'] = bench_report(data_file(parse_rows(args.rows[0]), args.seed, args.data_dir), args.repeat,
+                                        stages)
+        for s, r in result['report'].items():
+            print('{:>10}       {:<14} {:9.3f} s'.format('report', s, r['seconds']))
+    if not os.path.exists(args.results):
+        os.makedirs(args.results)
+    out = os.path.join(args.results, sha + ('-dirty' if dirty else '') + '.json')
+    with open(out, 'w') as f:
+        json.dump(result, f, indent=1)
+    print('results in', out)
+
+
+def compare(args):  # stage by stage times of two results, new / old < 1 is faster
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    print('{} -> {}'.format(old['commit'], new['commit']))
+    sections = [('report', old.get('report', {}), new.get('report', {}))]
+    sections = [(rows, old['rows'][rows], new['rows'][rows]) for rows in old['rows'] if rows in new['rows']] + sections
+    for name, a, b in sections:
+        for s in a:
+            if s in b:
+                print('{:>10}  {:<14} {:9.3f} s {:9.3f} s  x{:.2f}'.format(name, s, a[s]['seconds'], b[s]['seconds'],
+                                                                           b[s]['seconds'] / a[s]['seconds']))
+
+
+###  Correctness check  ################################################################################################
+
+def naive_counts(path):
+    # arh Sum, gc1 and gc3 counts computed the way the first version of generator.py did: one query of the ql list
+    # per row of the index list on the raw CSV, then one selection per confidence level bin
+    df = pd.read_csv(path, sep=";", na_values=["UNK", "N/A"], names=generator.names, skiprows=1)
+    df = df.dropna(how='all', subset=['plate', 'country', 'plr', 'ctr'])
+    counts = []
+    for n in range(3):
+        q = [df.query(generator.ql[n][i], engine='python') for i in range(6)]
+        conf = generator.confi[n]
+        bins = np.zeros((len(generator.edges), 6), dtype=np.int64)
+        for k, lo in enumerate(generator.edges):
+            for i in range(6):
+                c = q[i][conf]
+                top = c <= 100 if k == len(generator.edges) - 1 else c < generator.edges[k + 1]
+                bins[k, i] = ((c >= lo) & top).sum()
+        inv = bins[::-1].cumsum(axis=0)[::-1]
+        aut = inv[:, 0] - inv[:, 5]
+        fp = inv[:, 4] + inv[:, 3]
+        counts.append({'arh': np.array([len(x) for x in q]),
+                       'gc1': np.vstack([bins, bins.sum(axis=0)]),
+                       'gc3': np.vstack([np.column_stack([inv, aut, fp]),
+                                         np.column_stack([inv, aut, fp]).max(axis=0)])})
+    return counts
+
+
+def table_counts(report):  # the same counts from the tables of generator.py
+    arh, gc1, gc2, gc3, sweep = report['tables']
+    return [{'arh': arh[n]['Sum'].values.astype(np.int64),
+             'gc1': gc1[n][generator.index].values.astype(np.int64),
+             'gc3': gc3[n][generator.index + ['#Automation', '#FP']].values.astype(np.int64)} for n in range(3)]
+
+
+def grid_counts(exact, thr):
+    # counts of the sweep at every distinct confidence value (exact) at the thresholds thr: the ones of the first
+    # distinct value >= threshold, none above the last one
+    counts = np.vstack([exact[generator.index].values, np.zeros((1, len(generator.index)), dtype=np.int64)])
+    return counts[np.searchsorted(exact['Threshold'].values, np.asarray(thr) - 1e-9)]
+
+
+def check(args):
+    # counts of every loading path of generator.py against the naive reference, on a synthetic file with
+    # confidences on the bin edges, out of range and missing
+    work = tempfile.mkdtemp()
+    failed = 0
+    try:
+        path = os.path.join(work, 'check.csv')
+        synthesize(path, parse_rows(args.rows), args.seed, edge_rate=0.05)
+        ref = naive_counts(path)
+        cache = os.path.join(work, 'cache')
+        paths = [('in memory', {}), ('chunks', {'chunksize': 997}), ('parallel', {'jobs': 2, 'range_parts': 5}),
+                 ('cache', {'cache_dir': cache}), ('cache hit', {'cache_dir': cache}),
+                 ('groups', {'group_by': 'img:^site\\d'})]
+        for name, kw in paths:
+            parts = kw.pop('range_parts', None)
+            if parts:  # several byte ranges per worker even on a small file
+                generator.range_bytes = max(1, os.path.getsize(path) // parts)
+            opts = generator.options(**kw)
+            got = table_counts(generator.aggregate(generator.load(path, opts), opts))
+            bad = ['{} {}'.format(generator.dimensions[n], t) for n in range(3) for t in ref[n]
+                   if not np.array_equal(ref[n][t], got[n][t])]
+            print('{:<10} {}'.format(name, 'ok' if not bad else 'MISMATCH ' + ', '.join(bad)))
+            failed += bool(bad)
+        # the sweep at every multiple of a step against the sweep at every distinct confidence value, on the grid
+        sweeps = [generator.aggregate(generator.load(path, opts), opts)['tables'][4]
+                  for opts in (generator.options(sweep=True), generator.options(sweep=True, sweep_step=0.1))]
+        bad = [generator.dimensions[n] for n in range(3) if not np.array_equal(
+            grid_counts(sweeps[0][n], sweeps[1][n]['Threshold']), sweeps[1][n][generator.index].values)]
+        print('{:<10} {}'.format('sweep', 'ok' if not bad else 'MISMATCH ' + ', '.join(bad)))
+        failed += bool(bad)
+    finally:
+        shutil.rmtree(work, ignore_errors=True)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="benchmarks and correctness check of generator.py")
+    sub = parser.add_subparsers(dest='command')
+    p = sub.add_parser('run', help="time the stages on synthetic files and store the results of this commit")
+    p.add_argument('--rows', nargs='+', default=['100k', '1M'], help="sizes, e.g. 100k 1M 10M 100M (default: 100k 1M)")
+    p.add_argument('--stages', nargs='+', choices=row_stages + report_stages, help="only these stages")
+    p.add_argument('--repeat', type=int, default=3, help="runs of every stage, the fastest is kept (default: 3)")
+    p.add_argument('--seed', type=int, default=0)
+    p.add_argument('--data-dir', default='bench_data', help="synthetic CSV files (default: bench_data)")
+    p.add_argument('--results', default='bench_results', help="directory of the results (default: bench_results)")
+    p = sub.add_parser('compare', help="compare two stored results")
+    p.add_argument('old')
+    p.add_argument('new')
+    p = sub.add_parser('check', help="check the counts of the tables against a naive reference")
+    p.add_argument('--rows', default='20000')
+    p.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('a command is needed: run, compare or check')
+    {'run': run, 'compare': compare, 'check': check}[args.command](args)
@@ -0,0 +1,111 @@
+import cProfile
+import os
+import re
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+try:
+    import resource  # not on Windows, the metrics have no peak RSS there
+except ImportError:
+    resource = None
+
+# names and run metrics shared by generator.py and pdfreport.py, apart from both: pdfreport importing them from
+# generator would load generator a second time when it runs as a script
+
+# names of the 3 dimensions, in the order of every list of 3
+dimensions = ["Text", "State", "Combined"]
+# row added after the index list with --near-miss
+near_row = "Near miss"
+# lower edges of the confidence level bins, the last bin is closed: [90-100]
+edges = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90]
+labels = ["[0-10)", "[10-20)", "[20-30)", "[30-40)", "[40-50)", "[50-60)", "[60-70)", "[70-80)", "[80-90)", "[90-100]"]
+# what happened to the images of both files of a comparison, from A to B
+changes = ['Fixed', 'Regressed', 'Unchanged success', 'Unchanged fail', 'Other fail', 'Newly counted',
+           'No longer counted', 'Not counted']
+
+
+###  Metrics  ##########################################################################################################
+
+# hits, misses and evictions of the --render-cache of the pdf charts and tables (see pdfreport.py) in this process
+render_counts = {'hits': 0, 'misses': 0, 'evicted': 0}
+
+
+def new_metrics(profile=None):
+    # collector of stage(), profile is the name of the stage run under cProfile
+    # allocations are traced from here on (tracemalloc slows the python parts of the run down a bit)
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    return {'stages': [], 'open': [], 'profile': profile, 'started': time.time()}
+
+
+def peak_rss(reset=False):
+    # peak resident set size of this process in bytes, None without the resource module
+    # on Linux the peak can be reset (clear_refs), elsewhere it is the peak since the start of the process
+    if reset:
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except (IOError, OSError):
+            pass
+        return None
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except (IOError, OSError):
+        pass
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if os.uname()[0] == 'Darwin' else rss * 1024  # bytes on macOS, kB on Linux
+
+
+def cpu_seconds():  # cpu time of this process and of its finished worker processes
+    if resource is None:
+        return time.process_time()
+    ru = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return time.process_time() + ru.ru_utime + ru.ru_stime
+
+
+@contextmanager
+def stage(metrics, name):
+    # measures the stage name of the run, yields its record: the caller may add 'rows' (rows/s are computed from it)
+    # stages may be nested, the peaks of an inner stage are carried over to the outer one
+    record = {'stage': name}
+    if metrics is None:
+        yield record
+        return
+    for parent in metrics['open']:  # the peaks are reset for the inner stage, keep what the outer ones saw so far
+        parent['_alloc_peak'] = max(parent['_alloc_peak'], tracemalloc.get_traced_memory()[1])
+        parent['_rss_peak'] = max(parent['_rss_peak'], peak_rss() or 0)
+    metrics['open'].append(record)
+    profiler = cProfile.Profile() if metrics['profile'] == name else None
+    alloc = tracemalloc.get_traced_memory()[0]
+    if hasattr(tracemalloc, 'reset_peak'):
+        tracemalloc.reset_peak()
+    peak_rss(reset=True)
+    record.update(_alloc_peak=0, _rss_peak=0)
+    wall, cpu = time.time(), cpu_seconds()
+    if profiler:
+        profiler.enable()
+    try:
+        yield record
+    finally:
+        if profiler:
+            profiler.disable()
+            profiler.dump_stats(re.sub(r'[^\w.-]', '_', name) + '.prof')
+        metrics['open'].pop()
+        current, peak = tracemalloc.get_traced_memory()
+        record['seconds'] = time.time() - wall
+        record['cpu_seconds'] = cpu_seconds() - cpu
+        record['peak_rss_bytes'] = max(peak_rss() or 0, record.pop('_rss_peak')) or None
+        record['alloc_bytes'] = current - alloc
+        record['alloc_peak_bytes'] = max(peak, record.pop('_alloc_peak')) - alloc
+        if 'rows' in record:
+            record['rows_per_second'] = record['rows'] / record['seconds'] if record['seconds'] else None
+        for parent in metrics['open']:
+            parent['_alloc_peak'] = max(parent['_alloc_peak'], peak)
+            parent['_rss_peak'] = max(parent['_rss_peak'], record['peak_rss_bytes'] or 0)
+        metrics['stages'].append(record)
@@ -1,18 +1,132 @@
+import argparse
+import asyncio
+import glob
+import hashlib
+import io
+import json
 import os
-
-import matplotlib.pyplot as plt  # v 2.2.2
+import pickle
+import re
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Pool
+from urllib.parse import unquote
+
+import numpy as np  # v 1.14.5
 import pandas as pd  # v 0.23.1
-from reportlab.lib import colors
-from reportlab.lib.pagesizes import A4
-from reportlab.pdfgen import canvas
-from reportlab.platypus import Table, TableStyle  # reportlab v 3.4.0
 
-# XlsxWriter v 1.0.5
-# numpy v 1.14.5
+from common import changes, dimensions, edges, labels, near_row, new_metrics, render_counts, stage
 
-# load the CSV file to a DataFrame
-raw = pd.read_csv("data_file.csv", sep=";", na_values=["UNK", "N/A"],
-                  names=['img', 'plate', 'country', 'is_ok', 'plr', 'ctr', 'conf3', 'conf1', 'conf2'], skiprows=1)
+# XlsxWriter v 1.0.5
+# matplotlib v 2.2.2 and reportlab v 3.4.0 are imported by render_pdf only (see pdfreport.py)
+
+parser = argparse.ArgumentParser(description="ARH evaluation of a CSV file to an excel report and a pdf report")
+parser.add_argument('csv', nargs='?', default='data_file.csv',
+                    help="the CSV file to evaluate (default: data_file.csv)")
+parser.add_argument('--excel', default='Report.xlsx', metavar='PATH',
+                    help="path of the excel report (default: Report.xlsx)")
+parser.add_argument('--pdf', default='plik.pdf', metavar='PATH',
+                    help="path of the pdf report (default: plik.pdf)")
+parser.add_argument('--json', metavar='PATH',
+                    help="also write the tables of the report as JSON to PATH")
+only = parser.add_mutually_exclusive_group()
+only.add_argument('--excel-only', action='store_true',
+                  help="write the excel report and no pdf, matplotlib and reportlab are not even imported")
+only.add_argument('--json-only', action='store_true',
+                  help="write only the JSON tables (to --json PATH, default: Report.json)")
+parser.add_argument('--excel-format', choices=['text', 'numeric'], default='text',
+                    help="percentages of the excel report as texts like '12.3%%' (default) or as numbers with a "
+                         "percent format, written row by row in xlsxwriter's constant memory mode")
+parser.add_argument('--batch', metavar='DIR|GLOB',
+                    help="evaluate every CSV file of DIR (or every file matched by GLOB) instead of a single file, "
+                         "one report per file plus Summary.xlsx of all of them, the files are shared by --jobs workers")
+parser.add_argument('--out-dir', default='.', metavar='DIR',
+                    help="directory of the reports of --batch and --serve, named after the input files (default: .)")
+parser.add_argument('--append', metavar='CSV',
+                    help="add the rows of CSV to the aggregate state of --state (images already in it are skipped) "
+                         "and write the reports of the whole state, instead of evaluating a single file")
+parser.add_argument('--state', default='Report.state', metavar='PATH',
+                    help="aggregate state file of --append, created by the first run (default: Report.state); it "
+                         "keeps an 8 byte hash of every image ever added, so it grows with the whole history")
+parser.add_argument('--compare', metavar='CSV',
+                    help="compare the images of the CSV file (A) with the same images in CSV (B, e.g. the export of "
+                         "a new ARH engine): fixed/regressed images and B-A of the tables on the sheet 'Diff' and the "
+                         "pdf (--group-by and --sweep are not used)")
+parser.add_argument('--serve', metavar='DIR',
+                    help="run as a service: evaluate every CSV file dropped into DIR (new or changed) with warm --jobs "
+                         "workers, write its reports to --out-dir and serve the arh/gc3 summaries as JSON and the "
+                         "reports on http://127.0.0.1:PORT/ (use --charts vector for sub-second pdfs)")
+parser.add_argument('--port', type=int, default=8000,
+                    help="port of the HTTP endpoint of --serve (default: 8000)")
+parser.add_argument('--sweep', action='store_true',
+                    help="add the #Automation/%%Automation/#FP/%%FP threshold sweep (sheet 'Sweep' and pdf charts)")
+parser.add_argument('--sweep-step', type=float, default=0, metavar='STEP',
+                    help="threshold step of the sweep in %%, e.g. 0.1 (default: every distinct confidence value)")
+parser.add_argument('--chunksize', type=int, default=0, metavar='ROWS',
+                    help="stream the CSV in chunks of ROWS rows, memory is bounded by the chunk size "
+                         "(default: load at once)")
+parser.add_argument('--jobs', type=int, default=1, metavar='N',
+                    help="use N worker processes to parse the CSV (each one reads its own byte ranges of the file, "
+                         "a file with quoted fields is parsed by the main process, a quoted newline may cross a range) "
+                         "and to render the excel report and the pdf sections at the same time")
+parser.add_argument('--chart-files', action='store_true',
+                    help="also save the pdf charts as imgs/chart1_<title>.png and imgs/chart2_<title>.png (raster, "
+                         "not used with --batch)")
+parser.add_argument('--charts', choices=['raster', 'vector'], default='raster',
+                    help="pdf charts as 800 dpi matplotlib images (default) or drawn as reportlab vector graphics")
+parser.add_argument('--cache-dir', metavar='DIR',
+                    help="keep the parsed CSV as memory-mappable columns in DIR and reuse it while the file is "
+                         "unchanged (only when the file is loaded at once: --jobs and --chunksize parse the CSV and "
+                         "skip the cache)")
+parser.add_argument('--cache-size', type=int, default=2048, metavar='MB',
+                    help="size cap of the cache directory, least recently used entries are evicted (default: 2048)")
+parser.add_argument('--invalidate-cache', action='store_true',
+                    help="drop the cached copies of the CSV file before loading it")
+parser.add_argument('--render-cache', metavar='DIR',
+                    help="keep the pdf charts and tables in DIR, keyed by a hash of their data, style and library "
+                         "versions, and reuse the unchanged ones instead of drawing them again (hits and misses are "
+                         "printed at the end of the run)")
+parser.add_argument('--render-cache-size', type=int, default=512, metavar='MB',
+                    help="size cap of the render cache, least recently used entries are evicted (default: 512)")
+parser.add_argument('--metrics', metavar='PATH',
+                    help="write the time, cpu time, peak RSS and allocations of every stage of the run "
+                         "(and the rows/s of the ingestion) to PATH")
+parser.add_argument('--metrics-format', choices=['json', 'prometheus'], default='json',
+                    help="format of --metrics: JSON (default) or the Prometheus text format")
+parser.add_argument('--profile', metavar='STAGE',
+                    help="run the stage STAGE (load, load.parse, load.classify, aggregate, excel, json, pdf, "
+                         "pdf.charts, pdf.canvas, append, batch, compare) under cProfile and dump it to STAGE.prof; "
+                         "with --jobs the file is parsed and the pdf charts drawn by the workers, load.parse, "
+                         "load.classify, pdf.charts and pdf.canvas are not stages of the run then")
+parser.add_argument('--near-miss', type=int, metavar='K',
+                    help="count the misread plates (GT!=NA&ARH!=NA) at most K edits (characters inserted, removed or "
+                         "replaced) away from the real plate as near misses, a row of their own in the tables and "
+                         "charts, the scored pairs are kept in --cache-dir for the next runs")
+parser.add_argument('--confusables', default='O0,D0,Q0,I1,B8,S5,Z2,G6', metavar='PAIRS',
+                    help="character pairs an ANPR engine mixes up, replaced for free by --near-miss "
+                         "(default: O0,D0,Q0,I1,B8,S5,Z2,G6)")
+parser.add_argument('--bootstrap', type=int, default=0, metavar='N',
+                    help="add confidence intervals to the %%, %%Automation and %%FP of the tables (excel columns, pdf "
+                         "error bars) from N multinomial resamples of the bin x outcome counts, e.g. 2000")
+parser.add_argument('--ci-level', type=float, default=95, metavar='LEVEL',
+                    help="level of the --bootstrap intervals in %% (default: 95)")
+parser.add_argument('--group-by', metavar='COLUMN|img:REGEX',
+                    help="add one sheet and one pdf section per group, groups are the values of a column "
+                         "(e.g. country) or the part of img matched by REGEX (e.g. 'img:^[^_]+')")
+
+
+def options(**kw):  # options of the pipeline for library use, the command line defaults changed by kw
+    opts = parser.parse_args([])
+    for k, v in kw.items():
+        if not hasattr(opts, k):
+            raise TypeError("unknown option '{}'".format(k))
+        setattr(opts, k, v)
+    return opts
+
+
+# columns of the CSV file
+names = ['img', 'plate', 'country', 'is_ok', 'plr', 'ctr', 'conf3', 'conf1', 'conf2']
 '''
 img = Image name
 plate = Plate recorded
@@ -24,13 +138,12 @@ conf3 = Confidence level combined
 conf1 = Confidence level of Plate guessing
 conf2 = Confidence level of Country/State guessing
 '''
-# Exclude images where GT == N/A and ARH == N/A
-raw.dropna(inplace=True, how='all', subset=['plate', 'country', 'plr', 'ctr'])
 
 ###################################################################################
 ###  List of variables used  ######################################################
 ###################################################################################
 '''
+agg - list of 3 dicts of mergeable accumulators (outcome counts, bins x outcome counts, conf min/max/sum/count)
 arh - list of DF's containing ARH evaluation for Text[0] State[1] and Combined[2]
 gc - list of 3 template DF's sorted by gc levels
 gc1 - list of 3 DF's prepared for sorted ARH evaluation
@@ -53,6 +166,7 @@ index = ["-Total", "Success", "-Fail",
          "GT=NA&ARH!=NA",
          "GT!=NA&ARH=NA"]
 # querry list of 3 lists, each for Text State and Combined
+# no longer run by the script, kept as the reference definition of the outcomes that classify() implements
 ql = [
     [
         "plr == plr or plate == plate",  # at least one not nan                             -Total
@@ -87,123 +201,711 @@ ql = [
 ###  List of functions used  ###################################################################################
 ################################################################################################################
 
-def calc_sum(df, n=0):
-    # df.query() returns new df, df.query()['img'] returns Series, df.query()['img'].count() returns value
-    # Preforms query i times and appends the list by number of elements in the query
-    # We use ['img'] instead of [ df.query(qlt[i].keys()[0] ] because its way faster
-    suma = [df.query(ql[n][i])['img'].count() for i in range(6)]
-    return suma
-
-
-def calc_prc(df, n=0):  # used in ARH evaluation for text state both only
-    mx = df.query(ql[n][0])['img'].size
-    procent_of_total = [str(round(df.query(ql[n][i])['img'].size / mx * 100, 1)) + '%' for i in range(6)]
-    return procent_of_total
+# Every row gets one small-int outcome code per dimension, the six rows of the index list are unions of codes
+# 0 - not counted (GT and ARH both nan), 1 - Success, 2 3 4 - the three kinds of Fail
+# Text/State: 2 = GT!=NA&ARH!=NA, 3 = GT=NA&ARH!=NA, 4 = GT!=NA&ARH=NA
+# Combined:   2 = fail text,      3 = fail state,     4 = fail both
+# 5 - near miss (--near-miss only): Text GT!=NA&ARH!=NA with a plate read almost right, Combined failed by such a text
+ncodes = 6
+oc = [[1, 2, 3, 4, 5],  # -Total
+      [1],  # Success
+      [2, 3, 4, 5],  # -Fail
+      [2, 5], [3], [4],
+      [5]]  # Near miss
+# (GT, ARH) column pairs for Text and State
+pairs = [('plate', 'plr'), ('country', 'ctr')]
+
+
+def compare_pair(df, p=0):
+    # returns (GT not nan, ARH not nan, GT == ARH) as numpy boolean arrays
+    # GT and ARH share one category dictionary (see encode), so these are integer comparisons of the codes
+    gt = df[pairs[p][0]].cat.codes.values
+    rd = df[pairs[p][1]].cat.codes.values
+    g = gt >= 0
+    r = rd >= 0
+    return g, r, g & (gt == rd)
+
+
+def classify(df, n=0, near=None):
+    # one pass over the columns instead of the 6 queries from the old ql list
+    # near: (k, confusables, cache dir) of --near-miss (see near_options), the near misses get code 5
+    if n < 2:
+        g, r, eq = compare_pair(df, n)
+        code = np.zeros(len(df), dtype=np.int8)
+        code[g & r] = 2
+        code[eq] = 1
+        code[~g & r] = 3
+        code[g & ~r] = 4
+        if near is not None and n == 0:
+            code[near_misses(df, code == 2, near)] = 5
+        return code
+    g, r, eqp = compare_pair(df, 0)
+    gs, rs, eqc = compare_pair(df, 1)
+    # 1 + text failed + 2 * state failed, only where both text and state are present
+    code = ((1 + ~eqp + 2 * ~eqc) * ((g | r) & (gs | rs))).astype(np.int8)
+    if near is not None:  # failed by the text only, a plate read almost right
+        code[near_misses(df, (code == 2) & g & r, near)] = 5
+    return code
+
+
+def calc_sum(cnt, rows=6):
+    # number of images for each row of the index list (and the near miss row) from the per code counts (last axis)
+    return [cnt[..., oc[i]].sum(axis=-1) for i in range(rows)]
+
+
+def table_index(a):  # rows of the tables of the accumulators a, the near miss row with --near-miss only
+    return index + [near_row] if a['near_miss'] else index
+
+
+###  Near misses  ######################################################################################################
+
+# distances of the (plate, plr) pairs already scored, {confusables: (sorted pair hashes, distances)}, kept for the run
+# and with --cache-dir in its near_miss_<hash of the confusables>.npz file, a pair is scored once across runs
+near_memo = {}
+
+
+def near_options(opts):
+    # (k, confusables, cache dir) given to classify, None without --near-miss
+    # the confusables are normalized ('0O,1I'), the distances of the memo depend on them
+    if opts.near_miss is None:
+        return None
+    chars = sorted(''.join(sorted(p.strip())) for p in opts.confusables.upper().split(',') if len(p.strip()) == 2)
+    return opts.near_miss, ','.join(chars), opts.cache_dir
+
+
+def near_misses(df, mask, near):
+    # which rows of mask (misread plates, plate and plr both present) are near misses, the distance is computed once
+    # per distinct (plate, plr) pair of category codes (plate and plr share one dictionary, see encode)
+    k, confusables, cache_dir = near
+    cats = np.asarray(df['plate'].cat.categories.values, dtype=str)
+    gt = df['plate'].cat.codes.values[mask].astype(np.int64)
+    rd = df['plr'].cat.codes.values[mask].astype(np.int64)
+    pair, inv = np.unique(gt * len(cats) + rd, return_inverse=True)
+    dist = pair_distances(cats[pair // max(len(cats), 1)], cats[pair % max(len(cats), 1)], confusables, cache_dir)
+    near_mask = np.zeros(len(mask), dtype=bool)
+    near_mask[mask] = dist[inv.ravel()] <= k
+    return near_mask
+
+
+def edit_distances(a, b, confusables=''):
+    # Levenshtein distances of the string pairs a[i], b[i] vectorized over the pairs: one numpy step per pair of
+    # character positions, replacing a character by its confusable one ('O0,B8') is free
+    n = len(a)
+    if not n:
+        return np.zeros(0, dtype=np.uint8)
+    la, lb = np.char.str_len(a), np.char.str_len(b)
+    # code points, the strings padded with 0
+    x = np.asarray(a, dtype='U{}'.format(max(la.max(), 1))).view(np.uint32).reshape(n, -1)
+    y = np.asarray(b, dtype='U{}'.format(max(lb.max(), 1))).view(np.uint32).reshape(n, -1)
+    free = np.zeros((256, 256), dtype=bool)
+    for p in confusables.split(','):
+        if len(p) == 2 and max(map(ord, p)) < 255:
+            free[ord(p[0]), ord(p[1])] = free[ord(p[1]), ord(p[0])] = True
+    xc, yc = np.minimum(x, 255), np.minimum(y, 255)
+    d = np.tile(np.arange(y.shape[1] + 1, dtype=np.int32), (n, 1))  # distances to the prefixes of b
+    for i in range(x.shape[1]):
+        row = np.empty_like(d)
+        row[:, 0] = i + 1
+        for j in range(y.shape[1]):
+            cost = ~((x[:, i] == y[:, j]) | free[xc[:, i], yc[:, j]])
+            row[:, j + 1] = np.minimum(np.minimum(d[:, j + 1], row[:, j]) + 1, d[:, j] + cost)
+        d = np.where((i < la)[:, None], row, d)  # a shorter than i + 1 characters: done
+    return np.minimum(d[np.arange(n), lb], 255).astype(np.uint8)
+
+
+def memo_path(cache_dir, confusables):
+    return os.path.join(cache_dir, 'near_miss_{}.npz'.format(
+        hashlib.blake2b(confusables.encode(), digest_size=8).hexdigest()))
+
+
+def load_memo(path):  # (sorted pair hashes, distances) of a memo file, empty when there is none (yet)
+    if path is None or not os.path.exists(path):
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.uint8)
+    f = np.load(path)
+    keys, dist = f['keys'], f['dist']
+    f.close()
+    return keys, dist
+
+
+def save_memo(path, keys, dist):
+    # merged with the pairs saved by other processes meanwhile, written next to the old file and renamed
+    old_keys, old_dist = load_memo(path)
+    keys, first = np.unique(np.concatenate([keys, old_keys]), return_index=True)
+    dist = np.concatenate([dist, old_dist])[first]
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    tmp = path + '.tmp{}'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        np.savez(f, keys=keys, dist=dist)
+    os.replace(tmp, path)
+
+
+def pair_distances(a, b, confusables='', cache_dir=None):
+    # edit distances of the pairs a[i], b[i], looked up in the memo, only the pairs never seen before are computed
+    if confusables not in near_memo:
+        near_memo[confusables] = load_memo(memo_path(cache_dir, confusables) if cache_dir else None)
+    keys, dist = near_memo[confusables]
+    h = pd.util.hash_pandas_object(pd.Series(a, dtype=object) + '\n' + pd.Series(b, dtype=object), index=False).values
+    known = in_sorted(h, keys)
+    out = np.zeros(len(h), dtype=np.uint8)
+    out[known] = dist[np.searchsorted(keys, h[known])]
+    if not known.all():
+        new = edit_distances(a[~known], b[~known], confusables)
+        out[~known] = new
+        keys, first = np.unique(np.concatenate([keys, h[~known]]), return_index=True)
+        dist = np.concatenate([dist, new])[first]
+        near_memo[confusables] = keys, dist
+        if cache_dir:
+            save_memo(memo_path(cache_dir, confusables), keys, dist)
+    return out
 
 
 # The conf list indicates the confidence level we are looking at by the n argument
 confi = ['conf1', 'conf2', 'conf3']
 
 
-def calc_min_gc(df, n=0):  # used in ARH evaluation for text state both only
-    min_gc = [str(df.query(ql[n][i])[confi[n]].min()) + '%' for i in range(6)]
-    return min_gc
+def bin_index(conf):
+    # confidence bin of every row, -1 where conf is nan or outside of [0, 100]
+    b = np.digitize(conf, edges) - 1
+    b[~((conf >= 0) & (conf <= 100))] = -1
+    return b
 
 
-def calc_max_gc(df, n=0):
-    max_gc = [str(df.query(ql[n][i])[confi[n]].max()) + '%' for i in range(6)]
-    return max_gc
+def calc_bins(conf, code, key, ngroups=1):
+    # outcome x bin count matrices (groups, bins, codes) with a single bincount over (group * bins + bin) * 6 + code
+    b = bin_index(conf)
+    ok = b >= 0
+    cnt = np.bincount((key[ok] * len(edges) + b[ok]) * ncodes + code[ok], minlength=ngroups * len(edges) * ncodes)
+    return cnt.reshape(ngroups, len(edges), ncodes)
 
 
-def calc_avg_gc(df, n=0):
-    avg_gc = [str(round(df.query(ql[n][i])[confi[n]].mean(), 1)) + '%' for i in range(6)]
-    return avg_gc
+def perc(v, numeric=False):  # a percentage as the text '12.3%', or as the number itself for the numeric excel format
+    return v if numeric else str(v) + '%'
 
 
-def insert_perc(df):  # used in ARH evaluation by confidence levels
-    s = df['-Total'][10]  # Colsum value
+def calc_stats(a, numeric=False):  # used in ARH evaluation for text state both only
+    # Sum, %, Min GC, Max GC and Avg GC from the accumulators of one dimension
+    suma = calc_sum(a['codes'], len(table_index(a)))
+    dic = {"Sum": suma, "%": [], "Min GC": [], "Max GC": [], "Avg GC": []}
+    for i in range(len(suma)):
+        c = a['cnt'][oc[i]].sum()
+        with np.errstate(divide='ignore', invalid='ignore'):  # nan% for a file without rows
+            dic["%"].append(perc(round(suma[i] / suma[0] * 100, 1), numeric))
+        # float32 confidences back to their decimal values in float64 (99.9 and not 99.90000153), as calc_sweep
+        dic["Min GC"].append(perc(np.round(np.float64(np.fmin.reduce(a['min'][oc[i]])), 4), numeric))
+        dic["Max GC"].append(perc(np.round(np.float64(np.fmax.reduce(a['max'][oc[i]])), 4), numeric))
+        dic["Avg GC"].append(perc(round(a['sum'][oc[i]].sum() / c if c else np.nan, 1), numeric))
+    return dic
 
-    df.insert(2, "%", [str(round(df['Success'][i] / s * 100, 1)) + '%' for i in range(df['Success'].size)],
-              allow_duplicates=True)
-    df.insert(4, "%", [str(round(df['-Fail'][i] / s * 100, 1)) + '%' for i in range(df['Success'].size)],
-              allow_duplicates=True)
-    df.insert(6, "%", [str(round(df['GT!=NA&ARH!=NA'][i] / s * 100, 1)) + '%' for i in range(df['Success'].size)],
-              allow_duplicates=True)
-    df.insert(8, "%", [str(round(df['GT=NA&ARH!=NA'][i] / s * 100, 1)) + '%' for i in range(df['Success'].size)],
-              allow_duplicates=True)
-    df.insert(10, "%", [str(round(df['GT!=NA&ARH=NA'][i] / s * 100, 1)) + '%' for i in range(df['Success'].size)],
-              allow_duplicates=True)
 
+def insert_perc(df, numeric=False):  # used in ARH evaluation by confidence levels
+    s = df['-Total'].iloc[-1]  # Colsum value
+
+    with np.errstate(divide='ignore', invalid='ignore'):  # nan% for a file without binned rows
+        df.insert(2, "%", [perc(round(df['Success'].iloc[i] / s * 100, 1), numeric) for i in range(df['Success'].size)],
+                  allow_duplicates=True)
+        df.insert(4, "%", [perc(round(df['-Fail'].iloc[i] / s * 100, 1), numeric) for i in range(df['Success'].size)],
+                  allow_duplicates=True)
+        df.insert(6, "%", [perc(round(df['GT!=NA&ARH!=NA'].iloc[i] / s * 100, 1), numeric)
+                           for i in range(df['Success'].size)], allow_duplicates=True)
+        df.insert(8, "%", [perc(round(df['GT=NA&ARH!=NA'].iloc[i] / s * 100, 1), numeric)
+                           for i in range(df['Success'].size)], allow_duplicates=True)
+        df.insert(10, "%", [perc(round(df['GT!=NA&ARH=NA'].iloc[i] / s * 100, 1), numeric)
+                            for i in range(df['Success'].size)], allow_duplicates=True)
+        if near_row in df.columns:
+            df.insert(12, "%", [perc(round(df[near_row].iloc[i] / s * 100, 1), numeric)
+                                for i in range(df['Success'].size)], allow_duplicates=True)
 
-def append_automation(df, n=0):  # used in inverse sum
-    df['#Automation'] = df['-Total'] - df["GT!=NA&ARH=NA"]
-    df['%Automation'] = [round(df['#Automation'][i] / df['-Total'][0] * 100, 1) if df['#Automation'][i] != 0 else 0 for
-                         i in range(df['#Automation'].size)]
 
+def calc_automation(df, n=0):  # used in inverse sum and threshold sweep
+    df['#Automation'] = df['-Total'] - df["GT!=NA&ARH=NA"]
+    aut = df['#Automation'].values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['%Automation'] = np.where(aut != 0, np.round(aut / df['-Total'].iloc[0] * 100, 1), 0)
     if n == 0:
         df['#FP'] = df["GT=NA&ARH!=NA"] + df["GT!=NA&ARH!=NA"]
     else:
         df['#FP'] = df["-Fail"]
-    df['%FP'] = [
-        round(df['#FP'][i] / df['#Automation'][i] * 100, 1) if df['#FP'][i] != 0 and df['#Automation'][i] != 0 else 0
-        for i in range(df['#FP'].size)]
-    df[' '] = [0, 10, 20, 30, 40, 50, 60, 70, 80, 90, ' ']
+    fp = df['#FP'].values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df['%FP'] = np.where((fp != 0) & (aut != 0), np.round(fp / aut * 100, 1), 0)
+
+
+def append_automation(df, n=0):  # used in inverse sum
+    calc_automation(df, n)
+    df[' '] = edges + [' ']
     df['  '] = df['%FP']
 
 
-def cdic(n=0):  # creates dict used to create DataFrame file (ARH evaluation)
-    return {"Sum": calc_sum(raw, n),
-            "%": calc_prc(raw, n),
-            "Min GC": calc_min_gc(raw, n),
-            "Max GC": calc_max_gc(raw, n),
-            "Avg GC": calc_avg_gc(raw, n)
-            }
-
-
-def cdic2(n=0):  # creates dict used to create DataFrame file
-    dic = {"[0-10)": calc_sum(raw.query("{}>=0 and {}<10".format(confi[n], confi[n])), n),
-           "[10-20)": calc_sum(raw.query("{}>=10 and {}<20".format(confi[n], confi[n])), n),
-           "[20-30)": calc_sum(raw.query("{}>=20 and {}<30".format(confi[n], confi[n])), n),
-           "[30-40)": calc_sum(raw.query("{}>=30 and {}<40".format(confi[n], confi[n])), n),
-           "[40-50)": calc_sum(raw.query("{}>=40 and {}<50".format(confi[n], confi[n])), n),
-           "[50-60)": calc_sum(raw.query("{}>=50 and {}<60".format(confi[n], confi[n])), n),
-           "[60-70)": calc_sum(raw.query("{}>=60 and {}<70".format(confi[n], confi[n])), n),
-           "[70-80)": calc_sum(raw.query("{}>=70 and {}<80".format(confi[n], confi[n])), n),
-           "[80-90)": calc_sum(raw.query("{}>=80 and {}<90".format(confi[n], confi[n])), n),
-           "[90-100]": calc_sum(raw.query("{}>=90 and {}<=100".format(confi[n], confi[n])), n)
-           }
-    return dic
+def calc_sweep(conf, code, key, ngroups=1, step=0):
+    # outcome counts (groups, thresholds, codes) at every distinct confidence value (one sort by np.unique)
+    # or at every multiple of step (no sort at all), sweep_table turns them into counts of conf >= threshold
+    ok = (conf >= 0) & (conf <= 100)
+    conf, code, key = conf[ok], code[ok], key[ok]
+    # float32 confidences are rounded back to their decimal values, 85.3 and not 85.30000305
+    conf = np.round(conf.astype(np.float64), 4)
+    if step:
+        thr = np.round(np.arange(0, 100 + step / 2, step), 6)
+        # in float64 and rounded: 1.3 / 0.1 is 12.999999999999998, not the 13th threshold
+        inv = np.minimum(np.floor(np.round(conf / step, 6)).astype(np.int64), len(thr) - 1)
+    else:
+        thr, inv = np.unique(conf, return_inverse=True)
+    cnt = np.bincount((key * len(thr) + inv) * ncodes + code, minlength=ngroups * len(thr) * ncodes)
+    return thr, cnt.reshape(ngroups, len(thr), ncodes)
+
+
+def merge_sweep(a, b):
+    thr, inv = np.unique(np.concatenate([a[0], b[0]]), return_inverse=True)
+    cnt = np.zeros((len(thr), ncodes), dtype=np.int64)
+    np.add.at(cnt, inv, np.concatenate([a[1], b[1]]))
+    return thr, cnt
+
+
+def sweep_table(thr, cnt, rows=index):  # curve table of the threshold sweep
+    if not len(thr):  # no confidence in [0, 100]: a single threshold 0 with all the counts 0
+        thr, cnt = np.zeros(1), np.zeros((1, cnt.shape[-1]), dtype=np.int64)
+    df = pd.DataFrame(np.stack(calc_sum(cnt[::-1].cumsum(axis=0)[::-1], len(rows)), axis=1), columns=rows)
+    df.insert(0, 'Threshold', thr)
+    calc_automation(df)
+    return df
+
+
+def read_csv(path, chunksize=None, skiprows=1):  # DataFrame, or an iterator of DataFrames when chunksize is given
+    return pd.read_csv(path, sep=";", na_values=["UNK", "N/A"], names=names, skiprows=skiprows, chunksize=chunksize)
+
+
+# format of the cache entries, part of the key
+# 3: text columns saved as fixed width unicode arrays on every pandas version (pickled object arrays before)
+cache_version = 3
+
+
+def file_key(path):
+    # cache key from path, size, mtime and a hash of the whole content
+    st = os.stat(path)
+    h = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(2 ** 20), b''):
+            h.update(block)
+    fingerprint = '{}|{}|{}|{}|{}'.format(cache_version, os.path.abspath(path), st.st_size, st.st_mtime, h.hexdigest())
+    return hashlib.blake2b(fingerprint.encode(), digest_size=16).hexdigest()
+
+
+def cache_entries(cache_dir):  # list of (entry dir, manifest dict, last use)
+    entries = []
+    for key in os.listdir(cache_dir):
+        manifest = os.path.join(cache_dir, key, 'manifest.json')
+        if os.path.exists(manifest):
+            with open(manifest) as f:
+                entries.append((os.path.join(cache_dir, key), json.load(f), os.path.getmtime(manifest)))
+    return entries
+
+
+def invalidate_cache(cache_dir, path):  # removes every cached copy of the file
+    for entry, manifest, used in cache_entries(cache_dir):
+        if manifest['path'] == os.path.abspath(path):
+            shutil.rmtree(entry, ignore_errors=True)
+
+
+def store_cache(df, entry, path):
+    # one .npy file per column, categoricals as codes plus their dictionary, strings as fixed width unicode
+    # plus a nan mask
+    tmp = entry + '.tmp{}'.format(os.getpid())
+    os.makedirs(tmp)
+    for col in df.columns:
+        s = df[col]
+        if str(s.dtype) == 'category':
+            np.save(os.path.join(tmp, col + '.cat.npy'), np.asarray(s.cat.categories.values, dtype=str))
+            np.save(os.path.join(tmp, col + '.npy'), s.cat.codes.values)
+        elif s.dtype.kind not in 'biuf':  # object, or the string dtype of newer pandas
+            np.save(os.path.join(tmp, col + '.na.npy'), s.isnull().values)
+            np.save(os.path.join(tmp, col + '.npy'), np.asarray(s.fillna('').values, dtype=str))
+        else:
+            np.save(os.path.join(tmp, col + '.npy'), s.values)
+    with open(os.path.join(tmp, 'manifest.json'), 'w') as f:
+        json.dump({'path': os.path.abspath(path), 'rows': len(df), 'created': time.time()}, f)
+    os.rename(tmp, entry)
+
+
+def load_cache(entry, text=()):
+    # numeric columns and category codes are memory-mapped, not read; a text column (img) is only read when it is in
+    # text, the frame would hold a copy of it as python strings and only --group-by looks at it
+    cols = {}
+    for col in names:
+        if col not in text and os.path.exists(os.path.join(entry, col + '.na.npy')):
+            continue
+        cols[col] = np.load(os.path.join(entry, col + '.npy'), mmap_mode='r')
+        if os.path.exists(os.path.join(entry, col + '.cat.npy')):
+            cols[col] = pd.Categorical.from_codes(cols[col], np.load(os.path.join(entry, col + '.cat.npy')))
+        elif os.path.exists(os.path.join(entry, col + '.na.npy')):
+            cols[col] = cols[col].astype(object)
+            cols[col][np.load(os.path.join(entry, col + '.na.npy'))] = np.nan
+    return pd.DataFrame(cols, columns=[col for col in names if col in cols])
+
+
+def evict_cache(cache_dir, cap):  # least recently used entries first until the directory fits in cap bytes
+    entries = sorted(cache_entries(cache_dir), key=lambda e: e[2])
+    sizes = [sum(os.path.getsize(os.path.join(e[0], f)) for f in os.listdir(e[0])) for e in entries]
+    total = sum(sizes)
+    for e, size in zip(entries, sizes):
+        if total <= cap:
+            break
+        shutil.rmtree(e[0], ignore_errors=True)
+        total -= size
+
+
+def load_raw(path, opts):
+    # the filtered frame of the CSV, through the columnar cache when --cache-dir is given
+    if not opts.cache_dir:
+        return prepare(read_csv(path))
+    if not os.path.exists(opts.cache_dir):
+        os.makedirs(opts.cache_dir)
+    if opts.invalidate_cache:
+        invalidate_cache(opts.cache_dir, path)
+    entry = os.path.join(opts.cache_dir, file_key(path))
+    if os.path.exists(os.path.join(entry, 'manifest.json')):
+        os.utime(os.path.join(entry, 'manifest.json'), None)  # last use, for the LRU eviction
+        try:
+            return load_cache(entry, [opts.group_by.split(':')[0]] if opts.group_by else [])
+        except (ValueError, OSError):  # an entry that can not be memory-mapped (e.g. a pickled column) is rebuilt
+            shutil.rmtree(entry, ignore_errors=True)
+    raw = prepare(read_csv(path))
+    invalidate_cache(opts.cache_dir, path)  # copies of older versions of the file
+    store_cache(raw, entry, path)
+    evict_cache(opts.cache_dir, opts.cache_size * 2 ** 20)
+    return raw
+
+
+# size of the byte ranges parsed by the workers, bounds the memory of a worker together with --chunksize
+range_bytes = 64 * 2 ** 20
+
+
+def read_range(path, start, end):
+    # bytes of a byte range, None when they have a quote: a quoted field may hold a newline and the range ends are
+    # only newline aligned, if a field is cut the ranges on both sides of the cut have a quote
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    return None if b'"' in data else io.BytesIO(data)
+
+
+def byte_ranges(path, parts):
+    # (path, start, end) newline aligned byte ranges covering the file without the header line
+    size = os.path.getsize(path)
+    with open(path, 'rb') as f:
+        f.readline()
+        bounds = [f.tell()]
+        for i in range(1, parts):
+            f.seek(max(bounds[0] + (size - bounds[0]) * i // parts, bounds[-1]))
+            f.readline()  # move to the start of the next line
+            bounds.append(max(f.tell(), bounds[-1]))
+    bounds.append(size)
+    return [(path, a, b) for a, b in zip(bounds, bounds[1:]) if b > a]
+
+
+def drop_empty(df):
+    # Exclude images where GT == N/A and ARH == N/A
+    df.dropna(inplace=True, how='all', subset=['plate', 'country', 'plr', 'ctr'])
+    return df
+
+
+def encode(df):
+    # plate/plr and country/ctr become categoricals sharing one dictionary per pair, N/A and UNK get code -1
+    m = len(df)
+    for gt, rd in pairs:
+        codes, uniques = pd.factorize(pd.concat([df[gt], df[rd]], ignore_index=True))
+        df[gt] = pd.Categorical.from_codes(codes[:m], uniques)
+        df[rd] = pd.Categorical.from_codes(codes[m:], uniques)
+    for c in confi:
+        df[c] = df[c].astype(np.float32)
+    # 0/1 flag, also when the column arrives as text ('0' is not ok), anything that is not a number is not ok
+    df['is_ok'] = pd.to_numeric(df['is_ok'], errors='coerce').fillna(0).astype(bool)
+    return df
+
+
+def prepare(df):  # filtered and encoded frame of a CSV or of one chunk of it
+    return encode(drop_empty(df))
+
+
+def group_keys(df, group_by=None):
+    # group index of every row and the group labels, a single group None without --group-by
+    if not group_by:
+        return np.zeros(len(df), dtype=np.int64), [None]
+    if group_by.startswith('img:'):
+        pattern = group_by[4:]
+        if not re.compile(pattern).groups:
+            pattern = '(' + pattern + ')'
+        s = df['img'].astype(str).str.extract(pattern, expand=False)
+        if isinstance(s, pd.DataFrame):  # first capture group
+            s = s.iloc[:, 0]
+    else:
+        s = df[group_by].astype(object)
+    key, groups = pd.factorize(s.fillna('N/A'))
+    return key.astype(np.int64), list(groups)
+
+
+def accumulate(df, n=0, key=None, ngroups=1, sweep=False, step=0, near=None):
+    # mergeable accumulators of one dimension for every group, everything the arh and gc tables are built from
+    return accumulate_codes(classify(df, n, near), df[confi[n]].values, key, ngroups, sweep, step, near is not None)
 
 
-def add_czart(czart, n=0, chart_data=0):
+def accumulate_codes(code, conf, key=None, ngroups=1, sweep=False, step=0, near_miss=False):
+    # accumulate from the outcome codes and confidences of the rows, without the frame (see compare_files)
+    # one pass: bincounts over group * 6 + code and one groupby on the same key
+    if key is None:
+        key = np.zeros(len(code), dtype=np.int64)
+    k = key * ncodes + code
+    g = pd.Series(conf).groupby(k)
+    gk = range(ngroups * ncodes)
+    codes = np.bincount(k, minlength=ngroups * ncodes).reshape(ngroups, ncodes)
+    bins = calc_bins(conf, code, key, ngroups)
+    mins = g.min().reindex(gk).values.reshape(ngroups, ncodes)
+    maxs = g.max().reindex(gk).values.reshape(ngroups, ncodes)
+    sums = pd.Series(conf.astype(np.float64)).groupby(k).sum().reindex(gk, fill_value=0).values
+    sums = sums.reshape(ngroups, ncodes)
+    cnts = g.count().reindex(gk, fill_value=0).values.reshape(ngroups, ncodes)
+    sweep = calc_sweep(conf, code, key, ngroups, step) if sweep else None
+    return [{'codes': codes[i], 'bins': bins[i], 'min': mins[i], 'max': maxs[i], 'sum': sums[i], 'cnt': cnts[i],
+             'sweep': (sweep[0], sweep[1][i]) if sweep else None, 'near_miss': near_miss} for i in range(ngroups)]
+
+
+def accumulate_frame(df, opts):
+    # {group: [Text, State, Combined accumulators]} of a frame, group None without --group-by
+    # and when no row is left: the zero accumulators of an empty file, as for the file loaded at once
+    key, groups = group_keys(df, opts.group_by)
+    groups = groups or [None]
+    near = near_options(opts)
+    accs = [accumulate(df, n, key, len(groups), opts.sweep, opts.sweep_step, near) for n in range(3)]
+    return {g: [accs[0][i], accs[1][i], accs[2][i]] for i, g in enumerate(groups)}
+
+
+def merge(a, b):  # accumulators of two chunks of the same dimension
+    return {'codes': a['codes'] + b['codes'],
+            'bins': a['bins'] + b['bins'],
+            'min': np.fmin(a['min'], b['min']),
+            'max': np.fmax(a['max'], b['max']),
+            'sum': a['sum'] + b['sum'],
+            'cnt': a['cnt'] + b['cnt'],
+            'sweep': merge_sweep(a['sweep'], b['sweep']) if a['sweep'] is not None else None,
+            'near_miss': a['near_miss']}
+
+
+def merge_parts(agg, part):  # merges two {group: [Text, State, Combined accumulators]}, agg may be None
+    if agg is None:
+        return part
+    for g, accs in part.items():
+        agg[g] = [merge(agg[g][n], accs[n]) for n in range(3)] if g in agg else accs
+    return agg
+
+
+def merge_groups(agg):  # accumulators of all the groups together, for the global summary
+    total = None
+    for accs in agg.values():
+        total = accs if total is None else [merge(total[n], accs[n]) for n in range(3)]
+    return total
+
+
+def accumulate_chunks(chunks, opts):
+    agg = None
+    for chunk in chunks:
+        agg = merge_parts(agg, accumulate_frame(prepare(chunk), opts))
+    return agg if agg is not None else empty_parts(opts)
+
+
+def empty_parts(opts):  # accumulators of a file without any row (header only), all the counts 0
+    return accumulate_frame(prepare(read_csv(io.StringIO(''), skiprows=0)), opts)
+
+
+def accumulate_range(job):  # worker of the parallel ingestion, only the small accumulators are sent back
+    path, start, end, opts = job
+    data = read_range(path, start, end)
+    if data is None:  # quoted fields, see load
+        return None
+    if opts.chunksize:
+        return accumulate_chunks(read_csv(data, opts.chunksize, skiprows=0), opts)
+    return accumulate_chunks([read_csv(data, skiprows=0)], opts)
+
+
+def cdic(a, numeric=False):  # creates dict used to create DataFrame file (ARH evaluation)
+    return calc_stats(a, numeric)
+
+
+def cdic2(a):  # creates the (bins x index) count matrix used to create DataFrame file
+    return np.stack(calc_sum(a['bins'], len(table_index(a))), axis=1)
+
+
+# seed of the bootstrap resamples (plus the dimension), the intervals of a report are the same on every run
+bootstrap_seed = 0
+
+
+def bootstrap_draws(a, reps, seed=0):
+    # reps multinomial resamples (reps, bins + 1, codes) of the bin x outcome count matrix of one dimension,
+    # the last row holds the rows counted without a bin (confidence nan or out of range)
+    cells = np.vstack([a['bins'], a['codes'][None] - a['bins'].sum(axis=0)])
+    total = cells.sum()
+    if total == 0:
+        return np.zeros((reps,) + cells.shape, dtype=np.int64)
+    rs = np.random.RandomState(seed)
+    return rs.multinomial(total, cells.ravel() / float(total), size=reps).reshape((reps,) + cells.shape)
+
+
+def bootstrap_ci(job):
+    # (low, high) percentiles of the arh %, gc3 %Automation and gc3 %FP of one dimension over all the resamples,
+    # the KPIs of every resample are computed at once like calc_stats and calc_automation do for the tables
+    a, reps, level, seed = job
+    rows = len(table_index(a))
+    draws = bootstrap_draws(a, reps, seed)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sums = np.stack(calc_sum(draws.sum(axis=1), rows), axis=1)  # (reps, rows)
+        pct = sums / sums[:, :1] * 100
+        inv = np.stack(calc_sum(draws[:, -2::-1].cumsum(axis=1)[:, ::-1], rows), axis=2)  # (reps, bins, rows)
+        aut = inv[:, :, 0] - inv[:, :, 5]
+        fp = inv[:, :, 4] + inv[:, :, 3]
+        aut_p = np.where(aut != 0, aut / inv[:, :1, 0] * 100, 0)
+        fp_p = np.where((fp != 0) & (aut != 0), fp / aut * 100, 0)
+    q = [(100 - level) / 2., 100 - (100 - level) / 2.]
+    return [np.round(np.percentile(x, q, axis=0), 1) for x in (pct, aut_p, fp_p)]
+
+
+def bootstrap_reports(reports, ci):
+    # confidence intervals of the 3 dimensions of every report (list of [Text, State, Combined] accumulators),
+    # ci = (replicates, level, jobs) or None, the (report, dimension) pairs are shared by the workers
+    if ci is None:
+        return [None] * len(reports)
+    reps, level, jobs = ci
+    work = [(a, reps, level, bootstrap_seed + n) for accs in reports for n, a in enumerate(accs)]
+    if jobs > 1 and len(work) > 1:
+        with Pool(min(jobs, len(work))) as pool:
+            cis = pool.map(bootstrap_ci, work)
+    else:
+        cis = [bootstrap_ci(job) for job in work]
+    return [cis[i:i + 3] for i in range(0, len(cis), 3)]
+
+
+def insert_ci(arh, gc3, ci, numeric=False):  # columns of the bootstrap intervals of one dimension
+    pct, aut, fp = ci
+    arh['% low'] = [perc(v, numeric) for v in pct[0]]
+    arh['% high'] = [perc(v, numeric) for v in pct[1]]
+    for name, v in (('%Automation', aut), ('%FP', fp)):
+        gc3[name + ' low'] = list(v[0]) + [np.nan]  # nothing on the Total row
+        gc3[name + ' high'] = list(v[1]) + [np.nan]
+
+
+def build_tables(accs, numeric=False, cis=None):
+    # arh, gc1, gc2, gc3 and sweep of one report from its Text State Combined accumulators
+    # numeric: percentages as numbers instead of '12.3%' texts, for the numeric excel format
+    # cis: bootstrap intervals of the 3 dimensions (see bootstrap_reports), added as columns of arh and gc3
+    # ARH evaluation DataFrames initialization, with the near miss row when the accumulators have it
+    rows = table_index(accs[0])
+    arh = [pd.DataFrame(cdic(accs[0], numeric), index=rows), pd.DataFrame(cdic(accs[1], numeric), index=rows),
+           pd.DataFrame(cdic(accs[2], numeric), index=rows)]
+    ####
+    # Template Dataframes sorted by GC levels
+    gc = [
+        pd.DataFrame(cdic2(accs[0]), index=labels, columns=rows),
+        pd.DataFrame(cdic2(accs[1]), index=labels, columns=rows),
+        pd.DataFrame(cdic2(accs[2]), index=labels, columns=rows)
+    ]
+    ####
+    # ARH evaluation ordered by GC levels
+    gc1 = [pd.concat([gc[i], pd.DataFrame({'Total': [gc[i][j].sum() for j in gc[0].columns]}, index=rows).transpose()])
+           for i in range(3)]
+    for i in range(3):
+        insert_perc(gc1[i], numeric)
+    ####
+    # Cumulative sum of images by the confidence level
+    gc2 = [gc[i].cumsum() for i in range(3)]
+    gc2 = [pd.concat([gc2[i],
+                      pd.DataFrame({'Total': [gc2[i][j].max() for j in gc[0].columns]}, index=rows).transpose()])
+           for i in range(3)]
+    for i in range(3):
+        gc2[i]['-Total'] = gc1[i]['-Total'].copy()
+    ####
+    # Global inverted cumulative sum
+    gc3 = [gc[i][::-1].cumsum()[::-1] for i in range(3)]
+    gc3 = [pd.concat([gc3[i],
+                      pd.DataFrame({'Total': [gc3[i][j].max() for j in gc[0].columns]}, index=rows).transpose()])
+           for i in range(3)]
+    for i in range(3):
+        append_automation(gc3[i])
+    if cis is not None:
+        for i in range(3):
+            insert_ci(arh[i], gc3[i], cis[i], numeric)
+    ####
+    # Threshold sweep of the automation and FP rates, one curve table per dimension
+    sweep = [None, None, None]
+    if accs[0]['sweep'] is not None:
+        sweep = [sweep_table(*accs[i]['sweep'], rows=rows) for i in range(3)]
+    return arh, gc1, gc2, gc3, sweep
+
+
+def sheet_name(group):  # excel sheet of a group, without the characters excel does not allow
+    return re.sub(r"[\[\]:*?/\\']", '_', str(group))[:31] or '_'
+
+
+# sheets of the report itself, and History that excel keeps for itself
+reserved_sheets = ['Sheet1', 'Sweep', 'Files', 'Diff', 'History']
+
+
+def sheet_names(groups):
+    # unique excel sheets of the groups, excel compares the names without case: a name already taken (by the report
+    # or by an earlier group, also after the cut to 31 characters and the replaced characters) gets _2, _3, ...
+    used = {s.lower() for s in reserved_sheets}
+    names = []
+    for g in groups:
+        name = base = sheet_name(g)
+        i = 1
+        while name.lower() in used:
+            i += 1
+            suffix = '_{}'.format(i)
+            name = base[:31 - len(suffix)] + suffix
+        used.add(name.lower())
+        names.append(name)
+    return names
+
+
+def add_czart(czart, n=0, chart_data=0, sheet='Sheet1'):
+    last = chart_data + len(edges) - 1  # one bar per confidence level bin
     czart.add_series({
         'name': 'Success',
-        'categories': "=Sheet1!$A${}:$A${}".format(chart_data, chart_data + 9),
-        'values': "=Sheet1!$C${}:$C${}".format(chart_data, chart_data + 9),
+        'categories': "='{}'!$A${}:$A${}".format(sheet, chart_data, last),
+        'values': "='{}'!$C${}:$C${}".format(sheet, chart_data, last),
         'fill': {'color': '#52ce33'},
     })
     if n == 0:
         # CUMSUM
         czart.add_series({
             'name': 'Fail',
-            'categories': "=Sheet1!$A${}:$A${}".format(chart_data, chart_data + 9),
-            'values': "=Sheet1!$D${}:$D${}".format(chart_data, chart_data + 9),
+            'categories': "='{}'!$A${}:$A${}".format(sheet, chart_data, last),
+            'values': "='{}'!$D${}:$D${}".format(sheet, chart_data, last),
             'fill': {'color': 'red'},
         })
     else:
         # TOTAL
         czart.add_series({
             'name': 'Fail',
-            'categories': "=Sheet1!$A${}:$A${}".format(chart_data, chart_data + 9),
+            'categories': "='{}'!$A${}:$A${}".format(sheet, chart_data, last),
             # '%' columns are added
-            'values': "=Sheet1!$E${}:$E${}".format(chart_data, chart_data + 9),
+            'values': "='{}'!$E${}:$E${}".format(sheet, chart_data, last),
             'fill': {'color': 'red'},
         })
     czart.set_x_axis({'name': 'Intervals'})
     czart.set_y_axis({'name': 'No. images'})
 
 
-def insert_charts(czarts=[], row=0):  # puts charts in to the excel file
+def add_near_miss(workbook, czart, col, chart_data=0, sheet='Sheet1'):
+    # near misses as a line over the bars of add_czart, col is the column of the near miss counts
+    last = chart_data + len(edges) - 1
+    line = workbook.add_chart({'type': 'line'})
+    line.add_series({
+        'name': near_row,
+        'categories': "='{}'!$A${}:$A${}".format(sheet, chart_data, last),
+        'values': "='{0}'!${1}${2}:${1}${3}".format(sheet, chr(ord('A') + col), chart_data, last),
+        'line': {'color': '#ff9800'},
+    })
+    czart.combine(line)
+
+
+def insert_charts(worksheet, czarts=[], row=0):  # puts charts in to the excel file
     czarts[0].set_size({'width': 550, 'height': 300})
     czarts[1].set_size({'width': 550, 'height': 300})
     czarts[2].set_size({'width': 550, 'height': 300})
@@ -212,347 +914,934 @@ def insert_charts(czarts=[], row=0):  # puts charts in to the excel file
     worksheet.insert_chart('E{}'.format(row + 16), czarts[2], {'x_offset': 15, 'y_offset': 5})
 
 
-########################################################################################################################
-########################################################################################################################
-########################################################################################################################
+# the 4 sections of a report sheet: title, chart titles (no charts for the first one)
+sheet_sections = [("ARH evaluation", None),
+                  ("ARH evaluation", 'Distribution of confidence levels {}'),
+                  ("Sum of images by the confidence level",
+                   'Sum of images along the scale of degrees\n of confidence for the {}'),
+                  ("Inverse sum of images by the confidence level",
+                   'Inverse sum of images along the scale of degrees\n of confidence for the {}')]
+# rows taken by the 3 charts of a section (two rows of 300 px high charts)
+chart_rows = 32
+
+
+def sheet_layout(arh, gc1, gc2, gc3):
+    # (title row, [startrow of the 3 tables], chart row or None) of every section of a report sheet
+    # computed from the sizes of the tables: header, rows and one empty row after each table
+    layout = []
+    row = 3
+    for tables, (title, chart) in zip([arh, gc1, gc2, gc3], sheet_sections):
+        starts = []
+        r = row + 2
+        for t in tables:
+            starts.append(r)
+            r += len(t) + 2
+        layout.append((row, starts, r if chart else None))  # the charts start on the row after the empty one
+        row = r + chart_rows if chart else r
+    return layout
+
+
+# columns holding percentages, numbers with these number formats in the numeric excel format
+perc_formats = {'%': '0.0%', 'Min GC': '0.0##%', 'Max GC': '0.0##%', 'Avg GC': '0.0%', '%Automation': '0.0%',
+                '%FP': '0.0%', '  ': '0.0%', '%Success': '0.0%', '% low': '0.0%', '% high': '0.0%',
+                '%Automation low': '0.0%', '%Automation high': '0.0%', '%FP low': '0.0%', '%FP high': '0.0%'}
+
+
+def cell_formats(workbook):  # formats of write_table, the header format is the one pandas uses for to_excel
+    fmts = {c: workbook.add_format({'num_format': f}) for c, f in perc_formats.items()}
+    fmts['header'] = workbook.add_format({'bold': True, 'border': 1, 'align': 'center', 'valign': 'top'})
+    return fmts
+
+
+def write_table(worksheet, row, tables, fmts, index=True, name=None, name_format=None):
+    # numeric excel format: tables = [(startcol, DataFrame)] side by side, written row by row like constant_memory
+    # mode needs, percentages as fractions with a percent format, name (e.g. "Text") in the corner cell
+    cells = [(col, df, df.astype(object).values, [fmts.get(c) for c in df.columns]) for col, df in tables]
+    for col, df, values, cf in cells:
+        if index and name is not None:
+            worksheet.write(row, col, name, name_format)
+        for j, c in enumerate(df.columns):
+            worksheet.write(row, col + index + j, c, fmts['header'])
+    for i in range(max(len(df) for col, df in tables)):
+        for col, df, values, cf in cells:
+            if i >= len(df):
+                continue
+            if index:
+                worksheet.write(row + 1 + i, col, df.index[i], fmts['header'])
+            for j, v in enumerate(values[i]):
+                if isinstance(v, float) and np.isnan(v):
+                    continue
+                if cf[j] is not None and not isinstance(v, str):  # rounded, 99.9 / 100 is 0.9990000000000001
+                    worksheet.write_number(row + 1 + i, col + index + j, round(v / 100., 10), cf[j])
+                else:
+                    worksheet.write(row + 1 + i, col + index + j, v)
+
+
+def write_sheet(writer, sheet, arh, gc1, gc2, gc3, heading="Doesn’t include image where GT == N/A e ARH == N/A"):
+    # writer is a pd.ExcelWriter (tables of texts written by to_excel) or, for the numeric excel format,
+    # an xlsxwriter Workbook in constant_memory mode (numeric tables written row by row, top to bottom)
+    numeric = not isinstance(writer, pd.ExcelWriter)
+    layout = sheet_layout(arh, gc1, gc2, gc3)
+    tables = [arh, gc1, gc2, gc3]
+    #############################################
+    ### TO EXCEL
+    #############################################
+    if numeric:
+        workbook = writer
+        worksheet = workbook.add_worksheet(sheet)
+    else:
+        # ARH, ARH BY GC, CUM SUM, INV CUM SUM
+        for t, (title_row, starts, chart_row) in zip(tables, layout):
+            for i in range(3):
+                t[i].to_excel(writer, sheet_name=sheet, startrow=starts[i])
+        #####################################
+        ## XlsxWriter Sheet initialization ##
+        #####################################
+        workbook = writer.book
+        worksheet = writer.sheets[sheet]
+
+    cell_format = workbook.add_format()
+    cell_format.set_align('right')
+
+    worksheet.set_column(0, 0, 18)
+    worksheet.set_column('E:M', 16)
+    worksheet.set_zoom(75)
+    ##########################################
+    # formatting
+    ##########################################
+    title = workbook.add_format({'bold': True, 'italic': True, 'font_size': 22})
+    subtitle = workbook.add_format({'bold': True, 'italic': True, 'font_size': 14})
+    fmts = cell_formats(workbook) if numeric else None
+
+    worksheet.set_row(1, 30, title)
+    worksheet.write('A2', heading)
+    # titles, subtitles and in the numeric format the tables, in the order of the rows
+    for t, (title_row, starts, chart_row), (name, chart_title) in zip(tables, layout, sheet_sections):
+        worksheet.set_row(title_row, 30, title)
+        worksheet.write(title_row, 0, name)
+        for i in range(3):
+            if numeric:
+                write_table(worksheet, starts[i], [(0, t[i])], fmts, name=dimensions[i], name_format=subtitle)
+            else:
+                worksheet.write(starts[i], 0, dimensions[i], subtitle)
+
+    #############################################
+    ### CHARTS
+    #############################################
+    # 3 charts per section, filled with values of the first rows of the tables (1 is for the table where '%'
+    # columns are added), unique name for each chart has to be set, inserted 3 at once at correct positions
+    for k, (title_row, starts, chart_row) in enumerate(layout):
+        if chart_row is None:
+            continue
+        charts = [workbook.add_chart({'type': 'column', 'subtype': 'stacked'}) for i in range(3)]
+        for i in range(3):
+            add_czart(charts[i], 1 if k == 1 else 0, starts[i] + 2, sheet)
+            columns = list(tables[k][i].columns)
+            if near_row in columns:
+                add_near_miss(workbook, charts[i], columns.index(near_row) + 1, starts[i] + 2, sheet)
+            charts[i].set_title({'name': sheet_sections[k][1].format(dimensions[i].upper())})
+        insert_charts(worksheet, charts, chart_row)
+
+
+def write_sweep(writer, sweep):  # curve tables of the threshold sweep side by side on the 'Sweep' sheet
+    if not isinstance(writer, pd.ExcelWriter):  # numeric excel format
+        worksheet = writer.add_worksheet('Sweep')
+        subtitle = writer.add_format({'bold': True, 'italic': True, 'font_size': 14})
+        for i, name in enumerate(dimensions):
+            worksheet.write(1, i * 13, name, subtitle)
+        write_table(worksheet, 2, [(i * 13, sweep[i]) for i in range(3)], cell_formats(writer), index=False)
+        return
+    for i in range(3):
+        sweep[i].to_excel(writer, sheet_name='Sweep', startrow=2, startcol=i * 13, index=False)
+    subtitle = writer.book.add_format({'bold': True, 'italic': True, 'font_size': 14})
+    for i, name in enumerate(dimensions):
+        writer.sheets['Sweep'].write(1, i * 13, name, subtitle)
+
+
+def write_files(writer, files):  # one row per input file of a batch, the 3 tables one under the other on 'Files'
+    if not isinstance(writer, pd.ExcelWriter):  # numeric excel format
+        worksheet = writer.add_worksheet('Files')
+        subtitle = writer.add_format({'bold': True, 'italic': True, 'font_size': 14})
+        fmts = cell_formats(writer)
+        for i, name in enumerate(dimensions):
+            worksheet.write(1 + i * (len(files[i]) + 4), 0, name, subtitle)
+            write_table(worksheet, 2 + i * (len(files[i]) + 4), [(0, files[i])], fmts)
+        worksheet.set_column(0, 0, 30)
+        return
+    subtitle = writer.book.add_format({'bold': True, 'italic': True, 'font_size': 14})
+    for i, name in enumerate(dimensions):
+        files[i].to_excel(writer, sheet_name='Files', startrow=2 + i * (len(files[i]) + 4))
+        writer.sheets['Files'].write(1 + i * (len(files[i]) + 4), 0, name, subtitle)
+    writer.sheets['Files'].set_column(0, 0, 30)
+
+
+def frame_json(df):  # plain lists of a DataFrame for json.dump, duplicate column names ('%') are kept
+    return json.loads(df.to_json(orient='split'))
+
+
+###  Metrics  ##########################################################################################################
+
+def count_rows(agg):  # rows of the CSV evaluated (the ones not dropped as GT == N/A and ARH == N/A)
+    return int(sum(accs[0]['codes'].sum() for accs in agg.values()))
+
+
+def write_metrics(metrics, path, fmt='json'):  # the stage records as JSON or in the Prometheus text format
+    if fmt == 'json':
+        with open(path, 'w') as f:
+            out = {'started': metrics['started'], 'stages': metrics['stages']}
+            if 'render_cache' in metrics:
+                out['render_cache'] = metrics['render_cache']
+            json.dump(out, f, indent=1)
+        return
+    gauges = [('seconds', 'wall time of the stage'), ('cpu_seconds', 'cpu time of the stage and its workers'),
+              ('peak_rss_bytes', 'peak resident set size during the stage'),
+              ('alloc_bytes', 'bytes allocated and not freed by the stage'),
+              ('alloc_peak_bytes', 'peak of the bytes allocated during the stage'),
+              ('rows', 'rows of the CSV ingested by the stage'), ('rows_per_second', 'ingestion rate of the stage')]
+    with open(path, 'w') as f:
+        for key, text in gauges:
+            f.write('# HELP arh_stage_{} {}\n# TYPE arh_stage_{} gauge\n'.format(key, text, key))
+            for record in metrics['stages']:
+                if record.get(key) is not None:
+                    f.write('arh_stage_{}{{stage="{}"}} {}\n'.format(key, record['stage'], record[key]))
+        for key, value in sorted(metrics.get('render_cache', {}).items()):
+            f.write('# HELP arh_render_cache_{0} render cache {0} of the pdf charts and tables\n'
+                    '# TYPE arh_render_cache_{0} counter\narh_render_cache_{0} {1}\n'.format(key, value))
 
-# the stream to excel file via pandas
-writer = pd.ExcelWriter('Report.xlsx', engine='xlsxwriter')
-
-# ARH evaluation DataFrames initialization
-arh = [pd.DataFrame(cdic(), index=index), pd.DataFrame(cdic(1), index=index), pd.DataFrame(cdic(2), index=index)]
-####
-# Template Dataframes sorted by GC levels
-gc = [
-    pd.DataFrame(cdic2(), index=index).transpose(),
-    pd.DataFrame(cdic2(1), index=index).transpose(),
-    pd.DataFrame(cdic2(2), index=index).transpose()
-]
-####
-# ARH evaluation ordered by GC levels
-gc1 = [pd.concat([gc[i], pd.DataFrame({'Total': [gc[i][j].sum() for j in gc[0].columns]}, index=index).transpose()]) for
-       i in range(3)]
-for i in range(3):
-    insert_perc(gc1[i])
-####
-# Cumulative sum of images by the confidence level
-gc2 = [gc[i].cumsum() for i in range(3)]
-gc2 = [pd.concat([gc2[i], pd.DataFrame({'Total': [gc2[i][j].max() for j in gc[0].columns]}, index=index).transpose()])
-       for i in range(3)]
-for i in range(3):
-    gc2[i]['-Total'] = gc1[i]['-Total'].copy()
-####
-# Global inverted cumulative sum
-gc3 = [gc[i][::-1].cumsum()[::-1] for i in range(3)]
-gc3 = [pd.concat([gc3[i], pd.DataFrame({'Total': [gc3[i][j].max() for j in gc[0].columns]}, index=index).transpose()])
-       for i in range(3)]
-for i in range(3):
-    append_automation(gc3[i])
-####
-
-#############################################
-### TO EXCEL
-#############################################
-# ARH
-arh[0].to_excel(writer, startrow=5)
-arh[1].to_excel(writer, startrow=13)
-arh[2].to_excel(writer, startrow=21)
-
-# ARH BY GC
-gc1[0].to_excel(writer, startrow=31)
-gc1[1].to_excel(writer, startrow=44)
-gc1[2].to_excel(writer, startrow=57)
-
-# CUM SUM
-gc2[0].to_excel(writer, startrow=104)
-gc2[1].to_excel(writer, startrow=117)
-gc2[2].to_excel(writer, startrow=130)
-
-# INV CUM SUM
-gc3[0].to_excel(writer, startrow=177)
-gc3[1].to_excel(writer, startrow=190)
-gc3[2].to_excel(writer, startrow=203)
-
-#####################################
-## XlsxWriter Sheet initialization ##
-#####################################
-workbook = writer.book
-worksheet = writer.sheets['Sheet1']
-
-cell_format = workbook.add_format()
-cell_format.set_align('right')
-
-worksheet.set_column(0, 0, 18)
-worksheet.set_column('E:M', 16)
-worksheet.set_zoom(75)
-##########################################
-# formatting
-##########################################
-title = workbook.add_format({'bold': True, 'italic': True, 'font_size': 22})
-subtitle = workbook.add_format({'bold': True, 'italic': True, 'font_size': 14})
-
-worksheet.set_row(1, 30, title)
-worksheet.set_row(3, 30, title)
-worksheet.set_row(29, 30, title)
-worksheet.set_row(102, 30, title)
-worksheet.set_row(175, 30, title)
-worksheet.write('A2', "Doesn’t include image where GT == N/A e ARH == N/A")
-worksheet.write('A4', "ARH evaluation")
-worksheet.write('A30', "ARH evaluation")
-worksheet.write('A103', "Sum of images by the confidence level")
-worksheet.write('A176', "Inverse sum of images by the confidence level")
-
-worksheet.write('A6', "Text", subtitle)
-worksheet.write('A14', "State", subtitle)
-worksheet.write('A22', "Combined", subtitle)
-
-worksheet.write('A32', "Text", subtitle)
-worksheet.write('A45', "State", subtitle)
-worksheet.write('A58', "Combined", subtitle)
-
-worksheet.write('A105', "Text", subtitle)
-worksheet.write('A118', "State", subtitle)
-worksheet.write('A131', "Combined", subtitle)
-
-worksheet.write('A178', "Text", subtitle)
-worksheet.write('A191', "State", subtitle)
-worksheet.write('A204', "Combined", subtitle)
-
-#############################################
-### CHARTS
-#############################################
-# list of chart objects
-charts = [workbook.add_chart({'type': 'column', 'subtype': 'stacked'}) for i in range(9)]
-
-# Filling charts with values
-# chart object, 1 stands for table where '%' columns are added, row were to read values
-add_czart(charts[0], 1, 33)
-add_czart(charts[1], 1, 46)
-add_czart(charts[2], 1, 59)
-
-add_czart(charts[3], 0, 106)
-add_czart(charts[4], 0, 119)
-add_czart(charts[5], 0, 132)
-
-add_czart(charts[6], 0, 179)
-add_czart(charts[7], 0, 192)
-add_czart(charts[8], 0, 205)
-
-# unique name for each chart has to be set
-charts[0].set_title({'name': 'Distribution of confidence levels TEXT'})
-charts[1].set_title({'name': 'Distribution of confidence levels STATE'})
-charts[2].set_title({'name': 'Distribution of confidence levels COMBINED'})
-charts[3].set_title({'name': 'Sum of images along the scale of degrees\n of confidence for the TEXT'})
-charts[4].set_title({'name': 'Sum of images along the scale of degrees\n of confidence for the STATE'})
-charts[5].set_title({'name': 'Sum of images along the scale of degrees\n of confidence for the COMBINED'})
-charts[6].set_title({'name': 'Inverse sum of images along the scale of degrees\n of confidence for the TEXT'})
-charts[7].set_title({'name': 'Inverse sum of images along the scale of degrees\n of confidence for the STATE'})
-charts[8].set_title({'name': 'Inverse sum of images along the scale of degrees\n of confidence for the COMBINED'})
-
-# insert 3 charts at once at correct positions
-insert_charts(charts[0:3], 70)
-insert_charts(charts[3:6], 143)
-insert_charts(charts[6:9], 216)
 
 ########################################################################################################################
-#### Excel file is completed here ####
-########################################################################################################################
-writer.save()
-########################################################################################################################
+###  Pipeline: load -> aggregate -> render_excel / render_pdf / render_json  ###########################################
 ########################################################################################################################
 
-plt.rcParams.update({'font.size': 7, 'axes.axisbelow': True})
-
-c = canvas.Canvas('plik.pdf', pagesize=A4)
-
-styleSmall = TableStyle([
-    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
-    ('VALIGN', (0, 0), (0, -1), 'TOP'),
-    ('VALIGN', (0, -1), (-1, -1), 'MIDDLE'),
-    ('INNERGRID', (0, 0), (-1, -1), 0.10, colors.lightgrey),
-    ('GRID', (0, 0), (-1, 0), 0.4, colors.grey),
-    ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-    ('BACKGROUND', (0, 0), (-1, 0), '#d3d3d3'),
-    ('BACKGROUND', (0, 2), (-1, 2), '#CCFF90'),
-    ('BACKGROUND', (0, 3), (-1, 3), '#ff8a80'),
-])
-styleLarge = TableStyle([
-    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
-    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
-    ('VALIGN', (0, 0), (0, -1), 'TOP'),
-    ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'),
-    ('INNERGRID', (0, 0), (-1, -1), 0.10, colors.lightgrey),
-    ('GRID', (0, 0), (-1, 0), 0.4, colors.grey),
-    ('GRID', (0, 11), (-1, 11), 0.3, colors.grey),
-    ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
-    ('BACKGROUND', (0, 0), (-1, 0), '#d3d3d3'),
-    ('BACKGROUND', (0, 1), (-1, 1), '#eeeeee'),
-    ('BACKGROUND', (0, 3), (-1, 3), '#eeeeee'),
-    ('BACKGROUND', (0, 5), (-1, 5), '#eeeeee'),
-    ('BACKGROUND', (0, 7), (-1, 7), '#eeeeee'),
-    ('BACKGROUND', (0, 9), (-1, 9), '#eeeeee'),
-    ('BACKGROUND', (0, 11), (-1, 11), '#E0E0E0'),
-])
-
-
-def create_pdf(arh, gc, inv, title='CARACTERES'):
-    pwidth, height = A4
-    ###############################################################################
-    # Print Table #1
-    ###############################################################################
-    arh.insert(0, 'Type', arh.index.values)
-    tabela = [arh.columns]
-    for i in arh.index.values:
-        tabela.append(list((arh.loc[i])))
-    t = Table(tabela, [150, 67, 67, 67, 67, 67])  # == 485
-    t.setStyle(styleSmall)
-    w, h = t.wrap(pwidth, height)
-    t.drawOn(c, 55, 640)
-    ###############################################################################
-    # Prepare Table #2
-    ###############################################################################
-    c.drawCentredString(pwidth / 2, 800, title)
-    c.line(pwidth / 2 - c.stringWidth(title, "Helvetica", 12) / 2, 798,
-           pwidth / 2 + c.stringWidth(title, "Helvetica", 12) / 2, 798)
-    c.drawCentredString(pwidth / 2, 780, 'Resumo de Eesultados')
-    c.drawCentredString(pwidth / 2, 590, 'Distribuição do Grau de Confiança')
-    ################################################
-    gct_pdf = gc[['-Total', 'Success', '-Fail', "GT!=NA&ARH!=NA", "GT=NA&ARH!=NA", "GT!=NA&ARH=NA"]].copy()
-    gct_pdf.insert(0, 'GC\nLevels', gct_pdf.index.values)
-
-    gct_pdf["GT!=NA&ARH!=NA"] = [str(i) + '%' for i in
-                                 round(gct_pdf["GT!=NA&ARH!=NA"] / gct_pdf['-Total'][10] * 100, 1)]
-    gct_pdf["GT=NA&ARH!=NA"] = [str(i) + '%' for i in round(gct_pdf["GT=NA&ARH!=NA"] / gct_pdf['-Total'][10] * 100, 1)]
-    gct_pdf["GT!=NA&ARH=NA"] = [str(i) + '%' for i in round(gct_pdf["GT!=NA&ARH=NA"] / gct_pdf['-Total'][10] * 100, 1)]
-
-    gct_pdf.rename(index=str, columns={"GT!=NA&ARH!=NA": "GT<>NA\nARH<>NA", "GT=NA&ARH!=NA": "GT=NA\nARH<>NA",
-                                       "GT!=NA&ARH=NA": "GT<>NA\nARH=NA"}, inplace=True)
-    gct_pdf.insert(3, '%', round(gct_pdf['Success'] / gct_pdf['-Total'][10] * 100, 1), allow_duplicates=True)
-    gct_pdf.insert(5, ' %', round(gct_pdf['-Fail'] / gct_pdf['-Total'][10] * 100, 1), allow_duplicates=True)
-
-    gct_pdf_wo_colsum = gct_pdf.drop('Total')
-
-    ###############################################################################
-    # Print Chart #1
-    ###############################################################################
-
-    plt.rcParams.update({'font.size': 8, 'axes.axisbelow': True})
-    ind = [1, 2, 3, 4, 5, 6, 7, 8, 9, 10]  # the x locations for the groups
-    width = 0.45  # the width of the bars: can also be len(x) sequence
-
-    succ = tuple(gct_pdf_wo_colsum.iloc[:, 3])
-    fail = tuple(gct_pdf_wo_colsum.iloc[:, 5])
-
-    p1 = plt.bar(ind, succ, width, color='#CCFF90', edgecolor='black', linewidth=0.5)
-    p2 = plt.bar(ind, fail, width, bottom=succ, color='#ff8a80', edgecolor='black', linewidth=0.5)
-
-    plt.title('Distribuição dos graus de confinança para os {}'.format(title))
-    plt.xticks(ind, tuple(gct_pdf_wo_colsum['GC\nLevels']))
-    plt.yticks([0, 5, 10, 15, 20, 25, 30], ['0%', '5%', '10%', '15%', '20%', '25%', '30%'])
-    plt.grid(axis='y')
-    plt.legend((p1[0], p2[0]), ('Success', 'Fail'))
-
-    if not os.path.exists('imgs'):
-        os.makedirs('imgs')
-    plt.savefig('imgs/chart1_{}.png'.format(title), dpi=800)
-    c.drawImage('imgs/chart1_{}.png'.format(title), 20, 0, 555, 325)
-    plt.clf()
-    plt.close()
-    ###############################################################################
-    # Print Table #2
-    ###############################################################################
-    gct_pdf.iloc[:, 3] = [str(i) + '%' for i in gct_pdf.iloc[:, 3]]
-    gct_pdf.iloc[:, 5] = [str(i) + '%' for i in gct_pdf.iloc[:, 5]]
-
-    tabela = [gct_pdf.columns]
-    for i in gct_pdf.index.values:
-        tabela.append(list((gct_pdf.loc[i])))
-    t = Table(tabela, [55])
-    t.setStyle(styleLarge)
-    w, h = t.wrap(pwidth, height)
-    t.drawOn(c, 50, (height - 500))
-
-    c.showPage()
-    ###############################################################################
-    # Prepare Table #3
-    ###############################################################################
-    c.setFont('Times-Bold', 14)
-    c.drawCentredString(pwidth / 2, 760, 'Grau de Automação e Falsos Positivos')
-
-    gct_inv_pdf = inv.copy()
-
-    gct_inv_pdf.drop([' ', '  '], axis=1, inplace=True)
-    gct_inv_pdf.drop('Total', inplace=True)
-
-    gct_inv_pdf.insert(0, 'GC\nThreshold', [0, 10, 20, 30, 40, 50, 60, 70, 80, 90])
-
-    gct_inv_pdf.rename(index=str, columns={"Success": 'Success\n(1)', "-Fail": 'Fail\n(2)'
-        , "GT!=NA&ARH!=NA": "GT<>NA\nARH<>NA\n(3)", "GT=NA&ARH!=NA": "GT=NA\nARH<>NA\n(4)",
-                                           "GT!=NA&ARH=NA": "GT<>NA\nARH=NA\n(5)",
-                                           "#Automation": "#\nAutomati\non (6)", "%Automation": "%\nAutomati\non (7)",
-                                           "#FP": "# FP\n(8)", "%FP": "% FP\n(9)"}, inplace=True)
-
-    c.setFont("Helvetica", 9)
-    c.drawString(90, 430, 'Notas:')
-    c.drawString(160, 430, '#Automation(6) = (1)+(3)+(4)')
-    c.drawString(160, 410, '%Automation(7) = #Automation(6)/Total')
-    c.drawString(330, 430, '#FP(8) = (3)+(4)')
-    c.drawString(330, 410, '%FP(9) = #FP(8)/#Automation(6)')
-
-    ###############################################################################
-    # Print Chart #2
-    ###############################################################################
-    width = 0.35  # the width of the bars: can also be len(x) sequence
-
-    fig, ax = plt.subplots()
-
-    automacio = tuple(gct_inv_pdf["%\nAutomati\non (7)"])
-    rects1 = ax.bar([i - 0.03 for i in ind], automacio, width, color='#CCFF90', edgecolor='black', linewidth=0.5)
-
-    fp = tuple(gct_inv_pdf["% FP\n(9)"])
-    rects2 = ax.bar([i + width + 0.03 for i in ind], fp, width, color='#ff8a80', edgecolor='black', linewidth=0.5)
-
-    ax.set_title('KPI Automação e FP - {}'.format(title))
-    ax.set_xticks([(i + width / 2) for i in ind])
-    ax.set_xticklabels(('0%', '10%', '20%', '30%', '40%', '50%', '60', '70', '80', '90'))
-    ax.set_yticks([0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100, 108], ["0%", "10%", "20%", "30%", "40%", "50%",
-                                                                      "60%", "70%", "80%", "90%", "100%"])
-    ax.legend((rects1[0], rects2[0]), ('Automacio', 'Falsos Positivos'))
-
-    # Adding value over bars
-    for rect in rects1:
-        height = rect.get_height()
-        ax.text(rect.get_x() + rect.get_width() / 2., 1.01 * height, '%.1f' % height + str("%"), ha='center',
-                va='bottom', fontsize=5.5)
-    for rect in rects2:
-        height = rect.get_height()
-        ax.text(rect.get_x() + rect.get_width() / 2., 1.01 * height, '%.1f' % height + str("%"), ha='center',
-                va='bottom', fontsize=5.5)
-
-    plt.savefig('imgs/chart2_{}.png'.format(title), dpi=800)
-    c.drawImage('imgs/chart2_{}.png'.format(title), 20, 0, 575, 400)
-    plt.clf()
-    plt.close()
-    ###############################################################################
-    # Print Table #3
-    ###############################################################################
-    gct_inv_pdf.iloc[:, 8] = [str(i) + '%' for i in gct_inv_pdf.iloc[:, 8]]
-    gct_inv_pdf.iloc[:, 10] = [str(i) + '%' for i in gct_inv_pdf.iloc[:, 10]]
-
-    tabela = [gct_inv_pdf.columns]
-    for i in gct_inv_pdf.index.values:
-        tabela.append(list((gct_inv_pdf.loc[i])))
-
-    t = Table(tabela, [50], [40, 22, 22, 22, 22, 22, 22, 22, 22, 22, 22])
-    t.setStyle(styleLarge)
-    w, h = t.wrap(pwidth, height)
-    t.drawOn(c, 22, 460)
-    c.showPage()
-
-
-create_pdf(arh[0], gc1[0], gc3[0], 'CARACTERES')
-create_pdf(arh[1], gc1[1], gc3[1], 'ESTADO')
-create_pdf(arh[2], gc1[2], gc3[2], 'CARACTERES + ESTADO')
-
-c.save()
+def load(path='data_file.csv', opts=None, metrics=None):
+    # reduces the CSV file to {group: accumulators of Text State and Combined}, opts as returned by options()
+    # metrics (new_metrics) get the stages load.parse and load.classify when the file is loaded at once
+    opts = opts or options()
+    if opts.jobs > 1:
+        # parallel, byte ranges of the file are parsed and reduced by the workers and merged here
+        pool = Pool(opts.jobs)
+        ranges = byte_ranges(path, max(opts.jobs, os.path.getsize(path) // range_bytes + 1))
+        agg, quoted = None, False
+        for part in pool.imap_unordered(accumulate_range, [r + (opts,) for r in ranges]):
+            if part is None:
+                quoted = True
+            elif not quoted:
+                agg = merge_parts(agg, part)
+        pool.close()
+        pool.join()
+        if not quoted:
+            return agg if agg is not None else empty_parts(opts)
+        # a quoted field may hold a newline cut by the ranges, the file is loaded by this process as without --jobs
+    if opts.chunksize:
+        # streaming, only the accumulators of each chunk are kept
+        return accumulate_chunks(read_csv(path, opts.chunksize), opts)
+    with stage(metrics, 'load.parse'):
+        raw = load_raw(path, opts)
+    with stage(metrics, 'load.classify'):
+        return accumulate_frame(raw, opts)
+
+
+def ci_options(opts):  # (replicates, level, jobs) of the bootstrap intervals, None without --bootstrap
+    return (opts.bootstrap, opts.ci_level, opts.jobs) if opts.bootstrap else None
+
+
+def group_tables(accs, groups, numeric=False, cis=None):
+    # tables of the global summary (accs[0]), then of every group (accs[1:] of the labels groups)
+    # cis: the intervals of all the reports as returned by bootstrap_reports, computed once by aggregate
+    tables = [build_tables(a, numeric, c) for a, c in zip(accs, cis or [None] * len(accs))]
+    return tables[0], list(zip(groups, tables[1:]))
+
+
+def aggregate(agg, opts=None):
+    # tables of the report: the global summary, then one report per group (sorted, the order of arrival depends on
+    # chunks and workers), the accumulators and the intervals are kept for the tables of the numeric excel format
+    opts = opts or options()
+    groups = sorted((g for g in agg if g is not None), key=str)
+    accs = [merge_groups(agg)] + [agg[g] for g in groups]
+    cis = bootstrap_reports(accs, ci_options(opts))  # the intervals of all the reports are computed together
+    tables, groups = group_tables(accs, groups, cis=cis)
+    return {'agg': agg, 'tables': tables, 'groups': groups, 'group_by': opts.group_by, 'accs': accs, 'cis': cis}
+
+
+def render_excel(report, path='Report.xlsx', files=None, numeric=False):
+    # the stream to excel file via pandas, files are the per file tables of a batch summary (see batch_files_tables)
+    # numeric: percentages as numbers with a percent format, streamed by xlsxwriter itself in constant_memory mode
+    if numeric:
+        import xlsxwriter
+        writer = xlsxwriter.Workbook(path, {'constant_memory': True})
+        tables, groups = group_tables(report['accs'], [g for g, t in report['groups']], True, report['cis'])
+    else:
+        writer = pd.ExcelWriter(path, engine='xlsxwriter')
+        tables, groups = report['tables'], report['groups']
+    arh, gc1, gc2, gc3, sweep = tables
+    write_sheet(writer, 'Sheet1', arh, gc1, gc2, gc3)
+    if files is not None:
+        write_files(writer, files)
+    if sweep[0] is not None:
+        write_sweep(writer, sweep)
+    for (g, t), sheet in zip(groups, sheet_names([g for g, t in groups])):
+        write_sheet(writer, sheet, *t[:4], heading="{} = {}".format(report['group_by'], g))
+    writer.close()
+
+
+def render_pdf(report, path='plik.pdf', opts=None, metrics=None):
+    # matplotlib and reportlab are imported here and not at the start, runs without the pdf do not pay for them
+    import pdfreport
+    pdfreport.write_pdf(report, path, opts or options(), metrics)
+
+
+def render_json(report, path='Report.json'):
+    # every table of the report, {"Text": {"arh": {"index", "columns", "data"}, ...}, ...} plus the groups
+    def tables_json(tables):
+        return {dim: {name: frame_json(t[i]) if t[i] is not None else None
+                      for name, t in zip(['arh', 'gc1', 'gc2', 'gc3', 'sweep'], tables)}
+                for i, dim in enumerate(dimensions)}
+
+    with open(path, 'w') as f:
+        json.dump({'group_by': report['group_by'], 'total': tables_json(report['tables']),
+                   'groups': {str(g): tables_json(t) for g, t in report['groups']}}, f, indent=1)
+
+
+def snapshot(part):
+    # a part of the report frozen for the concurrent outputs: pickled once, every output works on a copy of its own
+    # and none of them can change what another one renders
+    return pickle.dumps(part, protocol=4)
+
+
+def excel_part(report, numeric=False):
+    # what render_excel reads of a report: the tables, or for the numeric format the accumulators and intervals the
+    # tables are built again from and the labels of the groups
+    if numeric:
+        return {'accs': report['accs'], 'cis': report['cis'], 'group_by': report['group_by'],
+                'groups': [(g, None) for g, t in report['groups']]}
+    return {k: report[k] for k in ['tables', 'groups', 'group_by']}
+
+
+def excel_job(job):
+    # worker of concurrent_reports: the excel report of a snapshot of excel_part, measured (and profiled) here when
+    # the run has metrics, the records of the stage are sent back
+    snap, path, numeric, measured, profile = job
+    metrics = new_metrics(profile) if measured else None
+    with stage(metrics, 'excel'):
+        render_excel(pickle.loads(snap), path, numeric=numeric)
+    return metrics['stages'] if measured else []
+
+
+def concurrent_reports(report, opts, excel='Report.xlsx', pdf='plik.pdf', json_path=None, metrics=None):
+    # the excel report and every section of the pdf rendered at once by --jobs worker processes, each one is sent a
+    # snapshot of only the part of the report it renders (see excel_part and pdfreport.report_sections)
+    # the pdf is assembled here from the charts and tables of the sections, in their order, as they come in
+    import pdfreport
+    numeric = opts.excel_format == 'numeric'
+    sections = pdfreport.report_sections(report)
+    wopts = argparse.Namespace(**vars(opts))
+    wopts.jobs = 1  # the workers do not start pools of their own
+    with ProcessPoolExecutor(min(opts.jobs, len(sections) + 1)) as executor:
+        xlsx = executor.submit(excel_job, (snapshot(excel_part(report, numeric)), excel, numeric, metrics is not None,
+                                           opts.profile))
+        futures = [executor.submit(pdfreport.section_job, (snapshot(section), wopts)) for section in sections]
+        if json_path:
+            with stage(metrics, 'json'):
+                render_json(report, json_path)
+
+        def parts():  # charts and tables of the sections, the render cache counts of the workers added to ours
+            for f in futures:
+                part, counts = f.result()
+                for k in counts:
+                    render_counts[k] += counts[k]
+                yield part
+
+        with stage(metrics, 'pdf'):
+            pdfreport.assemble_pdf(pdf, sections, parts(), opts)
+        records = xlsx.result()  # the excel stage as measured by its worker, not the wait for it
+        if metrics is not None:
+            metrics['stages'] += records
+
+
+def write_reports(report, opts, excel='Report.xlsx', pdf='plik.pdf', json_path=None, metrics=None):
+    # the outputs asked for by the options: excel and pdf, excel only or JSON only, plus JSON when json_path is given
+    # excel and pdf with --jobs: rendered concurrently (see concurrent_reports)
+    if opts.json_only:
+        with stage(metrics, 'json'):
+            render_json(report, json_path or 'Report.json')
+        return
+    if opts.jobs > 1 and not opts.excel_only:
+        concurrent_reports(report, opts, excel, pdf, json_path, metrics)
+        return
+    with stage(metrics, 'excel'):
+        render_excel(report, excel, numeric=opts.excel_format == 'numeric')
+    if json_path:
+        with stage(metrics, 'json'):
+            render_json(report, json_path)
+    if not opts.excel_only:
+        with stage(metrics, 'pdf'):
+            render_pdf(report, pdf, opts, metrics)
+
+
+###  Batch mode  #######################################################################################################
+
+def batch_paths(pattern):  # the CSV files of a directory, or the files matched by a glob pattern
+    if os.path.isdir(pattern):
+        pattern = os.path.join(pattern, '*.csv')
+    return sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+
+
+def batch_names(paths):
+    # report name of every input file, its path relative to the common directory of all the inputs
+    # (day exports of different sites may all be called data_file.csv)
+    common = os.path.commonpath([os.path.dirname(os.path.abspath(p)) for p in paths])
+    return [os.path.splitext(os.path.relpath(os.path.abspath(p), common))[0].replace(os.sep, '_') for p in paths]
+
+
+def warm_worker(opts):  # initializer of the batch workers, the slow imports are paid once per worker, not per file
+    if not (opts.excel_only or opts.json_only):
+        import pdfreport  # noqa: F401
+
+
+def batch_job(job):
+    # worker of the batch mode, one input file to its reports, the accumulators and render cache counts are sent back
+    path, name, opts = job
+    agg = load(path, opts)
+    out = os.path.join(opts.out_dir, name)
+    before = dict(render_counts)
+    write_reports(aggregate(agg, opts), opts, out + '.xlsx', out + '.pdf',
+                  out + '.json' if opts.json or opts.json_only else None)
+    after = dict(render_counts)
+    return name, agg, {k: after[k] - before[k] for k in after}
+
+
+def batch_files_tables(aggs, names, numeric=False):
+    # Sum of the index rows, % of Success and the automation/FP at threshold 0 of every file, one DF per dimension
+    rows = [[], [], []]
+    for name in names:
+        arh, gc1, gc2, gc3, sweep = build_tables(merge_groups(aggs[name]), numeric)
+        for n in range(3):
+            rows[n].append(list(arh[n]['Sum']) + [arh[n]['%'].iloc[1]] + list(gc3[n][['%Automation', '%FP']].iloc[0]))
+    columns = list(arh[0].index) + ['%Success', '%Automation', '%FP']
+    return [pd.DataFrame(rows[n], index=names, columns=columns) for n in range(3)]
+
+
+def batch(pattern, opts=None):
+    # reports of every file of a directory or glob pattern and the summary of all of them in opts.out_dir
+    # the files are shared by a pool of opts.jobs workers, each one imports matplotlib and reportlab once
+    opts = opts or options()
+    paths = batch_paths(pattern)
+    if not paths:
+        raise ValueError("no CSV files in '{}'".format(pattern))
+    if not os.path.exists(opts.out_dir):
+        os.makedirs(opts.out_dir)
+    names = batch_names(paths)
+    # one file per worker, the workers do not start pools of their own
+    wopts = argparse.Namespace(**vars(opts))
+    wopts.jobs = 1
+    wopts.chart_files = False
+    jobs = [(p, n, wopts) for p, n in zip(paths, names)]
+    if opts.jobs > 1:
+        pool = Pool(opts.jobs, initializer=warm_worker, initargs=(wopts,))
+        results = list(pool.imap_unordered(batch_job, jobs))
+        pool.close()
+        pool.join()
+    else:
+        results = [batch_job(job) for job in jobs]
+    aggs = {name: agg for name, agg, counts in results}
+    # every file together, merged from the accumulators sent back by the workers
+    total = {}
+    for name in names:
+        total = merge_parts(total, aggs[name])
+    report = aggregate(total, opts)
+    # render cache counts of the reports of the files, drawn by the workers
+    report['render_counts'] = {k: sum(counts[k] for name, agg, counts in results) for k in results[0][2]}
+    if opts.json_only:
+        render_json(report, os.path.join(opts.out_dir, 'Summary.json'))
+    else:
+        numeric = opts.excel_format == 'numeric'
+        files = batch_files_tables(aggs, names, numeric)
+        render_excel(report, os.path.join(opts.out_dir, 'Summary.xlsx'), files, numeric)
+    return report
+
+
+###  Append mode  ######################################################################################################
+
+# format of the state files
+state_version = 2
+# options the accumulators of a state depend on, a state can only be extended with the same ones
+state_options = ['group_by', 'sweep', 'sweep_step', 'near_miss', 'confusables']
+
+
+def img_hashes(df):  # 64 bit hash of every image name, processed images are kept in the state by these
+    return pd.util.hash_pandas_object(df['img'].astype(str), index=False).values
+
+
+def in_sorted(h, keys):  # which of the hashes h are in the sorted array keys
+    if not len(keys):
+        return np.zeros(len(h), dtype=bool)
+    pos = np.minimum(np.searchsorted(keys, h), len(keys) - 1)
+    return keys[pos] == h
+
+
+def load_state(path, opts):
+    # {'agg', 'seen' (sorted image hashes), options} of a state file, an empty state when there is no file yet
+    # the agg of an empty state has the zero accumulators (see empty_parts), a first CSV without new rows is a report
+    if not os.path.exists(path):
+        state = {'version': state_version, 'agg': empty_parts(opts), 'seen': np.zeros(0, dtype=np.uint64)}
+        state.update((k, getattr(opts, k)) for k in state_options)
+        return state
+    with open(path, 'rb') as f:
+        state = pickle.load(f)
+    if state['version'] != state_version:
+        raise ValueError("'{}' has the state format {}, expected {}".format(path, state['version'], state_version))
+    for k in state_options:
+        if state[k] != getattr(opts, k):
+            raise ValueError("'{}' was built with --{} {}, not {}".format(path, k.replace('_', '-'), state[k],
+                                                                        getattr(opts, k)))
+    if not state['agg']:  # saved empty by a first run without rows before the zero accumulators
+        state['agg'] = empty_parts(opts)
+    return state
+
+
+def save_state(state, path):  # written next to the old state and renamed, an interrupted run keeps the old one
+    tmp = path + '.tmp{}'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp, path)
+
+
+def append(path, state_path='Report.state', opts=None):
+    # adds the rows of path whose image is not in the state yet and returns the report of the whole state
+    # only the new rows are parsed and accumulated, the old ones are represented by the merged accumulators
+    opts = opts or options()
+    state = load_state(state_path, opts)
+    new = np.zeros(0, dtype=np.uint64)  # sorted hashes of the images added by this run
+    for chunk in read_csv(path, opts.chunksize) if opts.chunksize else [read_csv(path)]:
+        df = prepare(chunk)
+        h = img_hashes(df)
+        keep = ~in_sorted(h, state['seen']) & ~in_sorted(h, new)
+        first = np.zeros(len(h), dtype=bool)  # an image repeated within the chunk is counted once
+        first[np.unique(h, return_index=True)[1]] = True
+        keep &= first
+        if keep.any():
+            state['agg'] = merge_parts(state['agg'], accumulate_frame(df[keep], opts))
+            new = np.union1d(new, h[keep])
+    state['seen'] = np.union1d(state['seen'], new)
+    save_state(state, state_path)
+    return aggregate(state['agg'], opts)
+
+
+###  Compare mode  #####################################################################################################
+
+# rows of a chunk of the comparison when --chunksize is not given, both files are always streamed
+compare_chunk = 10 ** 6
+# outcome codes 0 - 5 of every dimension, the rows (A) and columns (B) of the transition tables (0 - 4 without
+# --near-miss)
+outcomes = [['Not counted', 'Success', 'GT!=NA&ARH!=NA', 'GT=NA&ARH!=NA', 'GT!=NA&ARH=NA', near_row]] * 2 + \
+           [['Not counted', 'Success', 'Fail text', 'Fail state', 'Fail both', near_row]]
+# sections of the 'Diff' sheet under the changes: title, key of the diff, tables written with their index
+diff_sections = [("Transitions of the images", 'transitions', True),
+                 ("ARH evaluation", 'arh', True),
+                 ("Automation and FP by GC threshold", 'curves', False)]
+
+
+def compact_rows(df, near=None):
+    # the rows of a file as the comparison keeps them: image hash, outcome code and confidence of every dimension
+    # (8 + 3 + 12 bytes a row), the frame itself is dropped
+    return (img_hashes(df), np.stack([classify(df, n, near) for n in range(3)]),
+            np.stack([df[c].values for c in confi]))
+
+
+def concat_compact(parts):  # compact rows of consecutive chunks, in the order of the file
+    if not parts:
+        return np.zeros(0, dtype=np.uint64), np.zeros((3, 0), dtype=np.int8), np.zeros((3, 0), dtype=np.float32)
+    return (np.concatenate([p[0] for p in parts]), np.concatenate([p[1] for p in parts], axis=1),
+            np.concatenate([p[2] for p in parts], axis=1))
+
+
+def compact_chunks(chunks, near=None):
+    # rows with GT and ARH all N/A are kept (code 0), an image read in one file only must still be joined
+    return concat_compact([compact_rows(encode(chunk), near) for chunk in chunks])
+
+
+def compact_range(job):  # worker of the parallel comparison, the compact rows of one byte range
+    path, start, end, opts = job
+    data = read_range(path, start, end)
+    if data is None:  # quoted fields, see load_compact
+        return None
+    return compact_chunks(read_csv(data, opts.chunksize or compare_chunk, skiprows=0), near_options(opts))
+
+
+def load_compact(path, opts, pool=None):  # compact rows of a whole file, streamed or parsed by the workers of pool
+    if pool is not None:
+        ranges = byte_ranges(path, max(opts.jobs, os.path.getsize(path) // range_bytes + 1))
+        parts = list(pool.imap(compact_range, [r + (opts,) for r in ranges]))
+        if all(part is not None for part in parts):
+            return concat_compact(parts)
+        # quoted fields (see read_range), streamed by this process
+    return compact_chunks(read_csv(path, opts.chunksize or compare_chunk), near_options(opts))
+
+
+def join_images(ha, hb):
+    # sorted join on the image hashes: the rows of a and of b of every image in both files (the first row of an image
+    # repeated in a file) and the numbers of distinct images of a and b
+    ua, ia = np.unique(ha, return_index=True)
+    ub, ib = np.unique(hb, return_index=True)
+    both = in_sorted(ua, ub)
+    return ia[both], ib[np.searchsorted(ub, ua[both])], len(ua), len(ub)
+
+
+def transitions(ca, cb, n=0, near_miss=False):
+    # (outcome in A x outcome in B) image counts of one dimension and its row of the changes table
+    t = np.bincount(ca.astype(np.int64) * ncodes + cb, minlength=ncodes ** 2).reshape(ncodes, ncodes)
+    same = np.trace(t[2:, 2:])
+    row = [t[2:, 1].sum(), t[1, 2:].sum(), t[1, 1], same, t[2:, 2:].sum() - same, t[0, 1:].sum(), t[1:, 0].sum(),
+           t[0, 0]]
+    k = ncodes if near_miss else ncodes - 1
+    return pd.DataFrame(t[:k, :k], index=['A: ' + o for o in outcomes[n][:k]],
+                        columns=['B: ' + o for o in outcomes[n][:k]]), row
+
+
+def delta_tables(ta, tb, n=0):
+    # A, B and B-A of the arh table and of the automation/FP curve (gc3) of one dimension, numeric build_tables
+    a, b = ta[0][n], tb[0][n]
+    arh = pd.DataFrame({'Sum A': a['Sum'], 'Sum B': b['Sum'], 'Sum B-A': b['Sum'] - a['Sum'],
+                        '% A': a['%'], '% B': b['%'], '% B-A': np.round(b['%'] - a['%'], 1)},
+                       index=a.index, columns=['Sum A', 'Sum B', 'Sum B-A', '% A', '% B', '% B-A'])
+    a, b = ta[3][n].iloc[:-1], tb[3][n].iloc[:-1]
+    curve = pd.DataFrame({'GC Threshold': edges,
+                          '%Automation A': a['%Automation'].values, '%Automation B': b['%Automation'].values,
+                          '%Automation B-A': np.round(b['%Automation'].values - a['%Automation'].values, 1),
+                          '%FP A': a['%FP'].values, '%FP B': b['%FP'].values,
+                          '%FP B-A': np.round(b['%FP'].values - a['%FP'].values, 1)},
+                         columns=['GC Threshold', '%Automation A', '%Automation B', '%Automation B-A',
+                                  '%FP A', '%FP B', '%FP B-A'])
+    return arh, curve
+
+
+def compare_files(path_a, path_b, opts=None):
+    # paired comparison of two exports of the same images (e.g. two ARH engine versions), A the old one, B the new one
+    # both files are reduced to compact rows and joined on the image, the images of both files are then accumulated
+    # like a single file: the A and B reports, the transitions of every image and the deltas of the tables
+    opts = opts or options()
+    pool = Pool(opts.jobs) if opts.jobs > 1 else None
+    a = load_compact(path_a, opts, pool)
+    b = load_compact(path_b, opts, pool)
+    if pool is not None:
+        pool.close()
+        pool.join()
+    ia, ib, na, nb = join_images(a[0], b[0])
+    near_miss = opts.near_miss is not None
+    aggs = [{None: [accumulate_codes(x[1][n][i], x[2][n][i], near_miss=near_miss)[0] for n in range(3)]}
+            for x, i in ((a, ia), (b, ib))]
+    ta, tb = [build_tables(agg[None], numeric=True) for agg in aggs]
+    diff = {'files': (path_a, path_b), 'images': (na, nb, len(ia)), 'rows': len(a[0]) + len(b[0]),
+            'reports': [aggregate(agg) for agg in aggs], 'transitions': [], 'arh': [], 'curves': []}
+    rows = []
+    for n in range(3):
+        t, row = transitions(a[1][n][ia], b[1][n][ib], n, near_miss)
+        arh, curve = delta_tables(ta, tb, n)
+        diff['transitions'].append(t)
+        diff['arh'].append(arh)
+        diff['curves'].append(curve)
+        rows.append(row)
+    diff['changes'] = pd.DataFrame(rows, index=dimensions, columns=changes)
+    return diff
+
+
+def diff_layout(diff):  # (title, 3 tables, index, title row) of the sections of the 'Diff' sheet
+    layout = []
+    row = 10
+    for title, key, idx in diff_sections:
+        layout.append((title, diff[key], idx, row))
+        row += len(diff[key][0]) + 5
+    return layout
+
+
+def write_diff(writer, diff):
+    # 'Diff' sheet: the files, the changes of the 3 dimensions, then their transition, arh and curve tables side by
+    # side, in the order of the rows for the numeric excel format (constant_memory)
+    numeric = not isinstance(writer, pd.ExcelWriter)
+    layout = diff_layout(diff)
+    if numeric:
+        workbook = writer
+        worksheet = workbook.add_worksheet('Diff')
+    else:
+        diff['changes'].to_excel(writer, sheet_name='Diff', startrow=5)
+        for name, tables, idx, row in layout:
+            for i in range(3):
+                tables[i].to_excel(writer, sheet_name='Diff', startrow=row + 2, startcol=i * 9, index=idx)
+        workbook = writer.book
+        worksheet = writer.sheets['Diff']
+    title = workbook.add_format({'bold': True, 'italic': True, 'font_size': 22})
+    subtitle = workbook.add_format({'bold': True, 'italic': True, 'font_size': 14})
+    fmts = cell_formats(workbook) if numeric else None
+    worksheet.set_column(0, 3 * 9, 18)
+    worksheet.set_zoom(75)
+
+    worksheet.write(1, 0, "A = {}".format(diff['files'][0]))
+    worksheet.write(2, 0, "B = {}".format(diff['files'][1]))
+    worksheet.write(3, 0, "Images: {} in A, {} in B, {} in both (the tables count these only)".format(*diff['images']))
+    worksheet.set_row(4, 30, title)
+    worksheet.write(4, 0, "Changes from A to B")
+    if numeric:
+        write_table(worksheet, 5, [(0, diff['changes'])], fmts)
+    for name, tables, idx, row in layout:
+        worksheet.set_row(row, 30, title)
+        worksheet.write(row, 0, name)
+        for i, dim in enumerate(dimensions):
+            worksheet.write(row + 1, i * 9, dim, subtitle)
+        if numeric:
+            write_table(worksheet, row + 2, [(i * 9, tables[i]) for i in range(3)], fmts, index=idx)
+
+
+def render_diff_excel(diff, path='Report.xlsx', numeric=False):
+    # the 'Diff' sheet, then the reports of A and B on the images of both files (sheets 'A' and 'B')
+    if numeric:
+        import xlsxwriter
+        writer = xlsxwriter.Workbook(path, {'constant_memory': True})
+    else:
+        writer = pd.ExcelWriter(path, engine='xlsxwriter')
+    write_diff(writer, diff)
+    for name, f, report in zip(['A', 'B'], diff['files'], diff['reports']):
+        tables = group_tables(report['accs'][:1], [], True, report['cis'][:1])[0] if numeric else report['tables']
+        write_sheet(writer, name, *tables[:4], heading="{} = {}, images of both files".format(name, f))
+    writer.close()
+
+
+def render_diff_pdf(diff, path='plik.pdf', metrics=None):  # one diff page per dimension, see render_pdf
+    import pdfreport
+    pdfreport.write_diff_pdf(diff, path, metrics)
+
+
+def render_diff_json(diff, path='Report.json'):
+    with open(path, 'w') as f:
+        json.dump({'files': diff['files'], 'images': dict(zip(['A', 'B', 'both'], map(int, diff['images']))),
+                   'changes': frame_json(diff['changes']),
+                   'dimensions': {dim: {key: frame_json(diff[key][i]) for key in ['transitions', 'arh', 'curves']}
+                                  for i, dim in enumerate(dimensions)}}, f, indent=1)
+
+
+def write_diff_reports(diff, opts, excel='Report.xlsx', pdf='plik.pdf', json_path=None, metrics=None):
+    # the outputs of a comparison, chosen like write_reports
+    if opts.json_only:
+        with stage(metrics, 'json'):
+            render_diff_json(diff, json_path or 'Report.json')
+        return
+    with stage(metrics, 'excel'):
+        render_diff_excel(diff, excel, numeric=opts.excel_format == 'numeric')
+    if json_path:
+        with stage(metrics, 'json'):
+            render_diff_json(diff, json_path)
+    if not opts.excel_only:
+        with stage(metrics, 'pdf'):
+            render_diff_pdf(diff, pdf, metrics)
+
+
+###  Service mode  #####################################################################################################
+
+# seconds between two scans of the watch directory, a file is taken once its size and mtime are the same in two scans
+poll_interval = 0.2
+# content types of the files served by the HTTP endpoint
+content_types = {'.json': 'application/json', '.pdf': 'application/pdf',
+                 '.xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'}
+
+
+def summary_json(agg):  # arh and gc3 of the whole file, the tables the service serves as JSON
+    arh, gc1, gc2, gc3, sweep = build_tables(merge_groups(agg))
+    return {dim: {'arh': frame_json(arh[i]), 'gc3': frame_json(gc3[i])} for i, dim in enumerate(dimensions)}
+
+
+def render_job(job):
+    # worker of the service, the reports of one file from its accumulators, written under temporary names and renamed
+    # so that the endpoint never serves a half written file
+    agg, name, opts = job
+    out = os.path.join(opts.out_dir, name)
+    tmp = os.path.join(opts.out_dir, '.' + name + '.tmp')
+    json_path = tmp + '.json' if opts.json or opts.json_only else None
+    try:
+        write_reports(aggregate(agg, opts), opts, tmp + '.xlsx', tmp + '.pdf', json_path)
+        for ext in ['.xlsx', '.pdf', '.json']:
+            if os.path.exists(tmp + ext):
+                os.replace(tmp + ext, out + ext)
+    finally:
+        for ext in ['.xlsx', '.pdf', '.json']:
+            if os.path.exists(tmp + ext):
+                os.remove(tmp + ext)
+    return name
+
+
+async def process_file(path, name, executor, opts, state, previous=None):
+    # aggregation and rendering of one dropped file by the workers, its summary is served as soon as it is aggregated
+    if previous is not None:  # an older version of the same file is still being processed
+        await previous
+    loop = asyncio.get_event_loop()
+    start = time.time()
+    entry = state['reports'].setdefault(name, {})  # the summary of an older version is served until replaced
+    entry.pop('error', None)
+    entry.update(file=path, status='aggregating', started=start)
+    try:
+        agg = await loop.run_in_executor(executor, load, path, opts)
+        entry.update(status='rendering', summary=summary_json(agg), rows=int(count_rows(agg)),
+                     summary_seconds=round(time.time() - start, 3))
+        state['latest'] = name
+        await loop.run_in_executor(executor, render_job, (agg, name, opts))
+        entry.update(status='ready', seconds=round(time.time() - start, 3))
+    except Exception as e:  # a broken file must not stop the service
+        entry.update(status='failed', error='{}: {}'.format(type(e).__name__, e))
+
+
+async def watch(opts, executor, state):
+    # scans the watch directory and hands every new or changed CSV file over to the workers
+    scanned = {}  # path: (size, mtime) of the last scan
+    taken = {}  # path: (size, mtime) of the version being or already processed
+    while True:
+        for path in batch_paths(opts.serve):
+            try:
+                st = os.stat(path)
+            except OSError:  # removed since the scan
+                continue
+            signature = (st.st_size, st.st_mtime_ns)
+            if taken.get(path) == signature:
+                continue
+            if scanned.get(path) == signature:  # no longer being written
+                taken[path] = signature
+                name = os.path.splitext(os.path.basename(path))[0]
+                state['tasks'][name] = asyncio.ensure_future(
+                    process_file(path, name, executor, opts, state, state['tasks'].get(name)))
+            scanned[path] = signature
+        await asyncio.sleep(poll_interval)
+
+
+def http_response(target, opts, state):
+    # (status, content type, body) of a GET of the endpoint:
+    # /                          every report of the service with its status and timings
+    # /latest, /reports/NAME     arh and gc3 summaries of the last file aggregated or of the file NAME.csv
+    # /latest.xlsx, .pdf, .json  the reports of that file once rendered (also /reports/NAME.xlsx ...)
+    def reply(status, obj):
+        return status, 'application/json', json.dumps(obj, indent=1).encode()
+
+    path = unquote(target.split('?')[0])
+    if path == '/':
+        return reply('200 OK', {'latest': state['latest'],
+                                'reports': {n: {k: v for k, v in e.items() if k != 'summary'}
+                                            for n, e in state['reports'].items()}})
+    name, ext = os.path.splitext(path)
+    if name == '/latest':
+        name = state['latest']
+    elif name.startswith('/reports/'):
+        name = name[len('/reports/'):]
+    else:
+        return reply('404 Not Found', {'error': 'unknown path ' + path})
+    entry = state['reports'].get(name)
+    if entry is None or 'summary' not in entry:
+        return reply('404 Not Found', {'error': 'no report of {}'.format(name)})
+    if not ext:
+        return reply('200 OK', dict(entry['summary'], name=name, file=entry['file'], rows=entry['rows']))
+    if ext not in content_types:
+        return reply('404 Not Found', {'error': 'unknown path ' + path})
+    if entry['status'] != 'ready':
+        return reply('503 Service Unavailable', {'name': name, 'status': entry['status']})
+    try:
+        with open(os.path.join(opts.out_dir, name + ext), 'rb') as f:
+            return '200 OK', content_types[ext], f.read()
+    except IOError:  # not written with these options (--excel-only, --json-only, no --json)
+        return reply('404 Not Found', {'error': 'no {} report of {}'.format(ext, name)})
+
+
+async def handle_http(reader, writer, opts, state):  # one request per connection, GET and HEAD only
+    request = (await reader.readline()).decode('latin-1').split()
+    while (await reader.readline()) not in (b'\r\n', b'\n', b''):  # headers are not used
+        pass
+    if len(request) >= 2 and request[0] in ('GET', 'HEAD'):
+        status, ctype, body = http_response(request[1], opts, state)
+    else:
+        status, ctype, body = '405 Method Not Allowed', 'text/plain', b'GET only\n'
+    writer.write('HTTP/1.0 {}\r\nContent-Type: {}\r\nContent-Length: {}\r\nConnection: close\r\n\r\n'.format(
+        status, ctype, len(body)).encode())
+    if request[:1] != ['HEAD']:
+        writer.write(body)
+    await writer.drain()
+    writer.close()
+
+
+def serve(opts=None):
+    # long running service: reports of every CSV file dropped into opts.serve, written to opts.out_dir and served on
+    # http://127.0.0.1:opts.port/ until interrupted
+    # the workers are started and warmed (pandas, matplotlib, reportlab) before the first file arrives
+    opts = opts or options()
+    if not os.path.exists(opts.out_dir):
+        os.makedirs(opts.out_dir)
+    wopts = argparse.Namespace(**vars(opts))
+    wopts.jobs = 1
+    wopts.chart_files = False
+    executor = ProcessPoolExecutor(max(opts.jobs, 1), initializer=warm_worker, initargs=(wopts,))
+    for f in [executor.submit(os.getpid) for i in range(max(opts.jobs, 1))]:
+        f.result()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    state = {'reports': {}, 'latest': None, 'tasks': {}}
+    server = loop.run_until_complete(asyncio.start_server(
+        lambda reader, writer: handle_http(reader, writer, opts, state), '127.0.0.1', opts.port))
+    print("watching {}, reports on http://127.0.0.1:{}/".format(opts.serve, opts.port))
+    try:
+        loop.run_until_complete(watch(wopts, executor, state))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+        executor.shutdown()
+        loop.close()
+
+
+def main(argv=None):
+    args = parser.parse_args(argv)
+    if args.sweep_step < 0:
+        parser.error("--sweep-step must be positive (0, the default: every distinct confidence value)")
+    if args.group_by and args.group_by.startswith('img:'):
+        try:
+            re.compile(args.group_by[4:])
+        except re.error as e:
+            parser.error("--group-by {}: not a regular expression ({})".format(args.group_by, e))
+    elif args.group_by and args.group_by not in names:
+        parser.error("--group-by {}: not a column, one of {} or img:REGEX".format(args.group_by, ', '.join(names)))
+    if args.jobs > 1 and args.profile in ('load.parse', 'load.classify', 'pdf.charts', 'pdf.canvas'):
+        parser.error("--profile {}: not a stage of a run with --jobs (see --profile)".format(args.profile))
+    metrics = new_metrics(args.profile) if args.metrics or args.profile else None
+    if args.serve:
+        if not os.path.isdir(args.serve):
+            parser.error("'{}' is not a directory".format(args.serve))
+        serve(args)
+        return
+    if args.batch:
+        if not batch_paths(args.batch):
+            parser.error("no CSV files in '{}'".format(args.batch))
+        with stage(metrics, 'batch') as st:
+            report = batch(args.batch, args)
+            st['rows'] = count_rows(report['agg'])
+    elif args.compare:
+        with stage(metrics, 'compare') as st:
+            diff = compare_files(args.csv, args.compare, args)
+            st['rows'] = diff['rows']
+        write_diff_reports(diff, args, args.excel, args.pdf, args.json, metrics)
+    elif args.append:
+        try:
+            with stage(metrics, 'append'):
+                report = append(args.append, args.state, args)
+        except ValueError as e:  # a state of other options
+            parser.error(str(e))
+        write_reports(report, args, args.excel, args.pdf, args.json, metrics)
+    else:
+        with stage(metrics, 'load') as st:
+            agg = load(args.csv, args, metrics)
+            st['rows'] = count_rows(agg)
+        with stage(metrics, 'aggregate'):
+            report = aggregate(agg, args)
+        write_reports(report, args, args.excel, args.pdf, args.json, metrics)
+    if args.render_cache:
+        counts = report['render_counts'] if args.batch else dict(render_counts)
+        print("render cache {}: {hits} hits, {misses} misses, {evicted} evicted".format(args.render_cache, **counts))
+        if metrics is not None:
+            metrics['render_cache'] = counts
+    if args.metrics:
+        write_metrics(metrics, args.metrics, args.metrics_format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,659 @@
+import hashlib
+import io
+import os
+import pickle
+import re
+from multiprocessing import Pool
+
+import matplotlib
+import matplotlib.pyplot as plt  # v 2.2.2
+import numpy as np  # v 1.14.5
+import pandas as pd  # v 0.23.1
+import reportlab
+from reportlab.graphics import renderPDF
+from reportlab.graphics.shapes import Drawing, Line, PolyLine, Rect, String
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+from reportlab.platypus import Table, TableStyle  # reportlab v 3.4.0
+
+from common import changes, dimensions, edges, labels, near_row, render_counts, stage
+
+# pdf part of the report, imported by generator.render_pdf only when the pdf is requested
+# (matplotlib and reportlab are the slowest imports of the whole script)
+
+plt.rcParams.update({'font.size': 7, 'axes.axisbelow': True})
+
+styleSmall = TableStyle([
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('VALIGN', (0, 0), (0, -1), 'TOP'),
+    ('VALIGN', (0, -1), (-1, -1), 'MIDDLE'),
+    ('INNERGRID', (0, 0), (-1, -1), 0.10, colors.lightgrey),
+    ('GRID', (0, 0), (-1, 0), 0.4, colors.grey),
+    ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+    ('BACKGROUND', (0, 0), (-1, 0), '#d3d3d3'),
+    ('BACKGROUND', (0, 2), (-1, 2), '#CCFF90'),
+    ('BACKGROUND', (0, 3), (-1, 3), '#ff8a80'),
+])
+styleLarge = TableStyle([
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('ALIGN', (1, 0), (-1, -1), 'RIGHT'),
+    ('VALIGN', (0, 0), (0, -1), 'TOP'),
+    ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'),
+    ('INNERGRID', (0, 0), (-1, -1), 0.10, colors.lightgrey),
+    ('GRID', (0, 0), (-1, 0), 0.4, colors.grey),
+    ('GRID', (0, len(edges) + 1), (-1, len(edges) + 1), 0.3, colors.grey),
+    ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+    ('BACKGROUND', (0, 0), (-1, 0), '#d3d3d3'),
+    ('BACKGROUND', (0, 1), (-1, 1), '#eeeeee'),
+    ('BACKGROUND', (0, 3), (-1, 3), '#eeeeee'),
+    ('BACKGROUND', (0, 5), (-1, 5), '#eeeeee'),
+    ('BACKGROUND', (0, 7), (-1, 7), '#eeeeee'),
+    ('BACKGROUND', (0, 9), (-1, 9), '#eeeeee'),
+    ('BACKGROUND', (0, len(edges) + 1), (-1, len(edges) + 1), '#E0E0E0'),
+])
+styleDiff = TableStyle([
+    ('FONTSIZE', (0, 0), (-1, -1), 8),
+    ('ALIGN', (0, 0), (-1, 0), 'CENTER'),
+    ('ALIGN', (1, 1), (-1, -1), 'RIGHT'),
+    ('VALIGN', (0, 0), (-1, 0), 'MIDDLE'),
+    ('INNERGRID', (0, 0), (-1, -1), 0.10, colors.lightgrey),
+    ('GRID', (0, 0), (-1, 0), 0.4, colors.grey),
+    ('BOX', (0, 0), (-1, -1), 0.25, colors.black),
+    ('BACKGROUND', (0, 0), (-1, 0), '#d3d3d3'),
+])
+# titles of the pdf sections of the 3 dimensions
+titles = ['CARACTERES', 'ESTADO', 'CARACTERES + ESTADO']
+
+
+def render_chart1(succ, fail, title, near=None):
+    # Chart #1 of create_pdf, stacked Success/Fail % per GC level, png bytes
+    # near: % of near misses (--near-miss), stacked between Success and the rest of Fail
+    plt.rcParams.update({'font.size': 8, 'axes.axisbelow': True})
+    plt.figure()
+    ind = list(range(1, len(edges) + 1))  # the x locations for the groups
+    width = 0.45  # the width of the bars: can also be len(x) sequence
+
+    p1 = plt.bar(ind, succ, width, color='#CCFF90', edgecolor='black', linewidth=0.5)
+    if near is None:
+        p2 = plt.bar(ind, fail, width, bottom=succ, color='#ff8a80', edgecolor='black', linewidth=0.5)
+    else:
+        p3 = plt.bar(ind, near, width, bottom=succ, color='#FFD180', edgecolor='black', linewidth=0.5)
+        p2 = plt.bar(ind, [f - m for f, m in zip(fail, near)], width, bottom=[s + m for s, m in zip(succ, near)],
+                     color='#ff8a80', edgecolor='black', linewidth=0.5)
+
+    plt.title('Distribuição dos graus de confinança para os {}'.format(title))
+    plt.xticks(ind, labels)
+    plt.yticks([0, 5, 10, 15, 20, 25, 30], ['0%', '5%', '10%', '15%', '20%', '25%', '30%'])
+    plt.grid(axis='y')
+    if near is None:
+        plt.legend((p1[0], p2[0]), ('Success', 'Fail'))
+    else:
+        plt.legend((p1[0], p3[0], p2[0]), ('Success', near_row, 'Fail'))
+
+    png = io.BytesIO()
+    plt.savefig(png, format='png', dpi=800)
+    plt.clf()
+    plt.close()
+    return png.getvalue()
+
+
+def error_bars(values, ci):  # (below, above) lengths of the error bars of the bars values, ci is (low, high)
+    return ([max(v - l, 0) for v, l in zip(values, ci[0])], [max(h - v, 0) for v, h in zip(values, ci[1])])
+
+
+def render_chart2(automacio, fp, title, sweep=None, ci=None):
+    # Chart #2 of create_pdf, %Automation and %FP per GC threshold, png bytes
+    # sweep is (thresholds, %Automation, %FP) of the threshold sweep or None
+    # ci is ((low, high) of %Automation, (low, high) of %FP) of the bootstrap intervals or None, drawn as error bars
+    plt.rcParams.update({'font.size': 8, 'axes.axisbelow': True})
+    ind = list(range(1, len(edges) + 1))  # the x locations for the groups
+    width = 0.35  # the width of the bars: can also be len(x) sequence
+
+    fig, ax = plt.subplots()
+
+    err = {'ecolor': 'black', 'elinewidth': 0.5, 'capsize': 1.5, 'capthick': 0.5}
+    rects1 = ax.bar([i - 0.03 for i in ind], automacio, width, color='#CCFF90', edgecolor='black', linewidth=0.5,
+                    yerr=error_bars(automacio, ci[0]) if ci else None, error_kw=err)
+    rects2 = ax.bar([i + width + 0.03 for i in ind], fp, width, color='#ff8a80', edgecolor='black', linewidth=0.5,
+                    yerr=error_bars(fp, ci[1]) if ci else None, error_kw=err)
+
+    ax.set_title('KPI Automação e FP - {}'.format(title))
+    ax.set_xticks([(i + width / 2) for i in ind])
+    ax.set_xticklabels(['{}%'.format(i) for i in edges])
+    ax.set_ylim(0, 108)
+    ax.set_yticks([0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100])
+    ax.set_yticklabels(["0%", "10%", "20%", "30%", "40%", "50%", "60%", "70%", "80%", "90%", "100%"])
+    if sweep is None:
+        ax.legend((rects1[0], rects2[0]), ('Automacio', 'Falsos Positivos'))
+    else:
+        # full threshold sweep drawn over the bars, threshold t is placed on the scale of the GC thresholds
+        x = np.interp(sweep[0], edges + [100], ind + [len(ind) + 1]) + width / 2
+        l1, = ax.plot(x, sweep[1], color='#33691E', linewidth=0.8)
+        l2, = ax.plot(x, sweep[2], color='#B71C1C', linewidth=0.8)
+        ax.legend((rects1[0], rects2[0], l1, l2),
+                  ('Automacio', 'Falsos Positivos', 'Automacio (sweep)', 'Falsos Positivos (sweep)'))
+
+    # Adding value over bars (over the error bars)
+    for k, rects in enumerate((rects1, rects2)):
+        for j, rect in enumerate(rects):
+            height = rect.get_height()
+            top = max(height, ci[k][1][j]) if ci else height
+            ax.text(rect.get_x() + rect.get_width() / 2., 1.01 * top, '%.1f' % height + str("%"), ha='center',
+                    va='bottom', fontsize=5.5)
+
+    png = io.BytesIO()
+    plt.savefig(png, format='png', dpi=800)
+    plt.clf()
+    plt.close()
+    return png.getvalue()
+
+
+def render_chart(job):  # worker of the chart rendering, job is (1 or 2, arguments of render_chart1/2)
+    kind, a = job
+    return render_chart1(*a) if kind == 1 else render_chart2(*a)
+
+
+def vector_frame(d, xlim, ylim, title, xticks, yticks, grid=False):
+    # axes of a vector chart laid out like the matplotlib figure, returns the data -> drawing coordinate functions
+    x0, x1, y0, y1 = d.width * 0.125, d.width * 0.9, d.height * 0.11, d.height * 0.88
+
+    def fx(x):
+        return x0 + (x - xlim[0]) / float(xlim[1] - xlim[0]) * (x1 - x0)
+
+    def fy(y):
+        return y0 + (y - ylim[0]) / float(ylim[1] - ylim[0]) * (y1 - y0)
+
+    for y, text in yticks:
+        if ylim[0] <= y <= ylim[1]:
+            if grid:
+                d.add(Line(x0, fy(y), x1, fy(y), strokeColor=colors.HexColor('#b0b0b0'), strokeWidth=0.4))
+            d.add(Line(x0 - 3, fy(y), x0, fy(y), strokeWidth=0.5))
+            d.add(String(x0 - 5, fy(y) - 3, text, fontName='Helvetica', fontSize=8, textAnchor='end'))
+    for x, text in xticks:
+        d.add(Line(fx(x), y0, fx(x), y0 - 3, strokeWidth=0.5))
+        d.add(String(fx(x), y0 - 12, text, fontName='Helvetica', fontSize=8, textAnchor='middle'))
+    d.add(String(d.width / 2, y1 + 6, title, fontName='Helvetica', fontSize=9.5, textAnchor='middle'))
+    return fx, fy
+
+
+def vector_box(d):  # axes box drawn last, over the bars
+    x0, x1, y0, y1 = d.width * 0.125, d.width * 0.9, d.height * 0.11, d.height * 0.88
+    d.add(Rect(x0, y0, x1 - x0, y1 - y0, fillColor=None, strokeWidth=0.6))
+
+
+def vector_legend(d, items):  # items are (color, label, 'bar' or 'line'), upper right corner of the axes
+    x1, y1 = d.width * 0.9, d.height * 0.88
+    lw = max(len(label) for color, label, kind in items) * 4.4 + 30
+    d.add(Rect(x1 - lw - 5, y1 - 14 * len(items) - 9, lw, 14 * len(items) + 4, fillColor=colors.white,
+               strokeColor=colors.HexColor('#cccccc'), strokeWidth=0.5))
+    for i, (color, label, kind) in enumerate(items):
+        y = y1 - 16 - 14 * i
+        if kind == 'bar':
+            d.add(Rect(x1 - lw, y, 16, 7, fillColor=colors.HexColor(color), strokeWidth=0.5))
+        else:
+            d.add(Line(x1 - lw, y + 3.5, x1 - lw + 16, y + 3.5, strokeColor=colors.HexColor(color), strokeWidth=0.8))
+        d.add(String(x1 - lw + 22, y, label, fontName='Helvetica', fontSize=8))
+
+
+def vector_bars(d, fx, fy, xs, heights, width, color, bottoms=None):
+    for i, (x, v) in enumerate(zip(xs, heights)):
+        b = bottoms[i] if bottoms else 0
+        if np.isnan(v) or np.isnan(b):  # no bar, as matplotlib does
+            continue
+        d.add(Rect(fx(x - width / 2.), fy(b), fx(x + width / 2.) - fx(x - width / 2.), fy(b + v) - fy(b),
+                   fillColor=colors.HexColor(color), strokeWidth=0.5))
+
+
+def vector_chart1(succ, fail, title, near=None):  # Chart #1 of create_pdf as reportlab graphics
+    d = Drawing(555, 325)
+    ind = list(range(1, len(edges) + 1))
+    width = 0.45
+    top = np.nanmax([s + f for s, f in zip(succ, fail)] + [0]) * 1.05 or 1
+    pad = (ind[-1] - ind[0] + width) * 0.05
+    fx, fy = vector_frame(d, (ind[0] - width / 2 - pad, ind[-1] + width / 2 + pad), (0, top),
+                          'Distribuição dos graus de confinança para os {}'.format(title),
+                          zip(ind, labels), [(y, '{}%'.format(y)) for y in [0, 5, 10, 15, 20, 25, 30]], grid=True)
+    vector_bars(d, fx, fy, ind, succ, width, '#CCFF90')
+    if near is None:
+        vector_bars(d, fx, fy, ind, fail, width, '#ff8a80', bottoms=succ)
+        items = [('#CCFF90', 'Success', 'bar'), ('#ff8a80', 'Fail', 'bar')]
+    else:
+        vector_bars(d, fx, fy, ind, near, width, '#FFD180', bottoms=succ)
+        vector_bars(d, fx, fy, ind, [f - m for f, m in zip(fail, near)], width, '#ff8a80',
+                    bottoms=[s + m for s, m in zip(succ, near)])
+        items = [('#CCFF90', 'Success', 'bar'), ('#FFD180', near_row, 'bar'), ('#ff8a80', 'Fail', 'bar')]
+    vector_box(d)
+    vector_legend(d, items)
+    return d
+
+
+def vector_errors(d, fx, fy, xs, ci, cap=0.04):  # error bars from ci[0] (low) to ci[1] (high) at xs
+    for x, l, h in zip(xs, ci[0], ci[1]):
+        if np.isnan(l) or np.isnan(h):
+            continue
+        d.add(Line(fx(x), fy(l), fx(x), fy(h), strokeWidth=0.5))
+        for y in (l, h):
+            d.add(Line(fx(x - cap), fy(y), fx(x + cap), fy(y), strokeWidth=0.5))
+
+
+def vector_chart2(automacio, fp, title, sweep=None, ci=None):  # Chart #2 of create_pdf as reportlab graphics
+    d = Drawing(575, 400)
+    ind = list(range(1, len(edges) + 1))
+    width = 0.35
+    left, right = ind[0] - 0.03 - width / 2, ind[-1] + width + 0.03 + width / 2
+    if sweep is not None:
+        sx = np.interp(sweep[0], edges + [100], ind + [len(ind) + 1]) + width / 2
+        right = max(right, sx.max())
+    pad = (right - left) * 0.05
+    fx, fy = vector_frame(d, (left - pad, right + pad), (0, 108), 'KPI Automação e FP - {}'.format(title),
+                          [(i + width / 2, '{}%'.format(e)) for i, e in zip(ind, edges)],
+                          [(y, '{}%'.format(y)) for y in range(0, 101, 10)])
+    vector_bars(d, fx, fy, [i - 0.03 for i in ind], automacio, width, '#CCFF90')
+    vector_bars(d, fx, fy, [i + width + 0.03 for i in ind], fp, width, '#ff8a80')
+    # Adding value over bars (over the error bars)
+    for k, (xs, values) in enumerate((([i - 0.03 for i in ind], automacio), ([i + width + 0.03 for i in ind], fp))):
+        if ci:
+            vector_errors(d, fx, fy, xs, ci[k])
+        for j, (x, v) in enumerate(zip(xs, values)):
+            if np.isnan(v):
+                continue
+            top = np.nanmax([v, ci[k][1][j]]) if ci else v
+            d.add(String(fx(x), fy(1.01 * top) + 1, '%.1f' % v + str("%"), fontName='Helvetica', fontSize=5.5,
+                         textAnchor='middle'))
+    items = [('#CCFF90', 'Automacio', 'bar'), ('#ff8a80', 'Falsos Positivos', 'bar')]
+    if sweep is not None:
+        for values, color in ((sweep[1], '#33691E'), (sweep[2], '#B71C1C')):
+            points = []
+            for xi, yi in zip(sx, values):
+                points += [fx(xi), fy(yi)]
+            d.add(PolyLine(points, strokeColor=colors.HexColor(color), strokeWidth=0.8))
+        items += [('#33691E', 'Automacio (sweep)', 'line'), ('#B71C1C', 'Falsos Positivos (sweep)', 'line')]
+    vector_box(d)
+    vector_legend(d, items)
+    return d
+
+
+def vector_chart(job):  # same jobs as render_chart, returns a reportlab Drawing
+    kind, a = job
+    return vector_chart1(*a) if kind == 1 else vector_chart2(*a)
+
+
+def chart_jobs(gc, inv, title, sweep=None):  # the two chart jobs of one create_pdf section, plain picklable data
+    s = gc['-Total'].iloc[-1] or 1  # no binned row: every count is 0 and so is every percentage, as calc_automation
+    succ = tuple(round(gc['Success'].iloc[:-1] / s * 100, 1))
+    fail = tuple(round(gc['-Fail'].iloc[:-1] / s * 100, 1))
+    near = tuple(round(gc[near_row].iloc[:-1] / s * 100, 1)) if near_row in gc.columns else None
+    if sweep is not None:
+        sweep = (sweep['Threshold'].values, sweep['%Automation'].values, sweep['%FP'].values)
+    ci = None
+    if '%Automation low' in inv.columns:  # bootstrap intervals, error bars of the bars
+        ci = tuple((tuple(inv[k + ' low'].iloc[:-1]), tuple(inv[k + ' high'].iloc[:-1]))
+                   for k in ('%Automation', '%FP'))
+    return [(1, (succ, fail, title, near)),
+            (2, (tuple(inv['%Automation'].iloc[:-1]), tuple(inv['%FP'].iloc[:-1]), title, sweep, ci))]
+
+
+def draw_chart(c, chart, x, y, w, h):  # png bytes of a raster chart or a reportlab Drawing of a vector chart
+    if isinstance(chart, bytes):
+        c.drawImage(ImageReader(io.BytesIO(chart)), x, y, w, h)
+    else:
+        renderPDF.draw(chart, c, x, y)
+
+
+def section_tables(arh, gc, inv, level=95):
+    # the 3 tables of a create_pdf section as wrapped reportlab Tables, level of the bootstrap intervals
+    # the frames of the report are not changed, the texts of the cells are formatted in copies
+    pwidth, height = A4
+    ###############################################################################
+    # Prepare Table #1
+    ###############################################################################
+    widths = [150, 67, 67, 67, 67, 67]  # == 485
+    if '% low' in arh.columns:  # the bootstrap interval of the % in a single column
+        arh = arh.drop(['% low', '% high'], axis=1).assign(
+            **{'IC {:g}%'.format(level): ['{} - {}'.format(l, h) for l, h in zip(arh['% low'], arh['% high'])]})
+        widths = [130, 60, 60, 60, 60, 60, 90]  # == 520
+    tabela = [['Type'] + list(arh.columns)]
+    for i in arh.index.values:
+        tabela.append([i] + list(arh.loc[i]))
+    t1 = Table(tabela, widths)
+    t1.setStyle(styleSmall)
+    t1.wrap(pwidth, height)
+    ###############################################################################
+    # Prepare Table #2
+    ###############################################################################
+    near = near_row in gc.columns
+    gct_pdf = gc[['-Total', 'Success', '-Fail', "GT!=NA&ARH!=NA", "GT=NA&ARH!=NA", "GT!=NA&ARH=NA"] +
+                 ([near_row] if near else [])].copy()
+    gct_pdf.insert(0, 'GC\nLevels', gct_pdf.index.values)
+
+    gct_pdf["GT!=NA&ARH!=NA"] = [str(i) + '%' for i in
+                                 round(gct_pdf["GT!=NA&ARH!=NA"] / gct_pdf['-Total'].iloc[-1] * 100, 1)]
+    gct_pdf["GT=NA&ARH!=NA"] = [str(i) + '%' for i in
+                                round(gct_pdf["GT=NA&ARH!=NA"] / gct_pdf['-Total'].iloc[-1] * 100, 1)]
+    gct_pdf["GT!=NA&ARH=NA"] = [str(i) + '%' for i in
+                                round(gct_pdf["GT!=NA&ARH=NA"] / gct_pdf['-Total'].iloc[-1] * 100, 1)]
+    if near:
+        gct_pdf[near_row] = [str(i) + '%' for i in round(gct_pdf[near_row] / gct_pdf['-Total'].iloc[-1] * 100, 1)]
+
+    gct_pdf.rename(index=str, columns={"GT!=NA&ARH!=NA": "GT<>NA\nARH<>NA", "GT=NA&ARH!=NA": "GT=NA\nARH<>NA",
+                                       "GT!=NA&ARH=NA": "GT<>NA\nARH=NA", near_row: "Near\nmiss"}, inplace=True)
+    # percentages inserted as texts, newer pandas does not let texts into a float column
+    gct_pdf.insert(3, '%', round(gct_pdf['Success'] / gct_pdf['-Total'].iloc[-1] * 100, 1).map('{}%'.format),
+                   allow_duplicates=True)
+    gct_pdf.insert(5, ' %', round(gct_pdf['-Fail'] / gct_pdf['-Total'].iloc[-1] * 100, 1).map('{}%'.format),
+                   allow_duplicates=True)
+
+    tabela = [gct_pdf.columns]
+    for i in gct_pdf.index.values:
+        tabela.append(list((gct_pdf.loc[i])))
+    t2 = Table(tabela, [50 if near else 55])
+    t2.setStyle(styleLarge)
+    t2.wrap(pwidth, height)
+    ###############################################################################
+    # Prepare Table #3
+    ###############################################################################
+    gct_inv_pdf = inv.copy()
+
+    gct_inv_pdf.drop([' ', '  '] + ([near_row] if near else []) +
+                     [k for k in inv.columns if k.endswith((' low', ' high'))], axis=1, inplace=True)
+    gct_inv_pdf.drop('Total', inplace=True)
+
+    gct_inv_pdf.insert(0, 'GC\nThreshold', edges)
+    gct_inv_pdf['%Automation'] = gct_inv_pdf['%Automation'].map('{}%'.format)  # new columns of texts
+    gct_inv_pdf['%FP'] = gct_inv_pdf['%FP'].map('{}%'.format)
+
+    gct_inv_pdf.rename(index=str, columns={"Success": 'Success\n(1)', "-Fail": 'Fail\n(2)'
+        , "GT!=NA&ARH!=NA": "GT<>NA\nARH<>NA\n(3)", "GT=NA&ARH!=NA": "GT=NA\nARH<>NA\n(4)",
+                                           "GT!=NA&ARH=NA": "GT<>NA\nARH=NA\n(5)",
+                                           "#Automation": "#\nAutomati\non (6)", "%Automation": "%\nAutomati\non (7)",
+                                           "#FP": "# FP\n(8)", "%FP": "% FP\n(9)"}, inplace=True)
+
+    tabela = [gct_inv_pdf.columns]
+    for i in gct_inv_pdf.index.values:
+        tabela.append(list((gct_inv_pdf.loc[i])))
+    t3 = Table(tabela, [50], [40] + [22] * len(edges))
+    t3.setStyle(styleLarge)
+    t3.wrap(pwidth, height)
+    return t1, t2, t3
+
+
+def create_pdf(c, arh, gc, inv, title='CARACTERES', chart1=b'', chart2=b'', level=95, tables=None):
+    # charts as png bytes or Drawings, tables as returned by section_tables (built here when not given)
+    pwidth, height = A4
+    t1, t2, t3 = tables or section_tables(arh, gc, inv, level)
+    ###############################################################################
+    # Print Table #1
+    ###############################################################################
+    t1.drawOn(c, 55, 640 - (len(arh) - 6) * 18)  # the near miss row goes down, not into the titles
+    c.drawCentredString(pwidth / 2, 800, title)
+    c.line(pwidth / 2 - c.stringWidth(title, "Helvetica", 12) / 2, 798,
+           pwidth / 2 + c.stringWidth(title, "Helvetica", 12) / 2, 798)
+    c.drawCentredString(pwidth / 2, 780, 'Resumo de Eesultados')
+    c.drawCentredString(pwidth / 2, 590, 'Distribuição do Grau de Confiança')
+    ###############################################################################
+    # Print Chart #1
+    ###############################################################################
+    draw_chart(c, chart1, 20, 0, 555, 325)
+    ###############################################################################
+    # Print Table #2
+    ###############################################################################
+    t2.drawOn(c, 50, (height - 500))
+
+    c.showPage()
+    ###############################################################################
+    # Notes of Table #3
+    ###############################################################################
+    c.setFont('Times-Bold', 14)
+    c.drawCentredString(pwidth / 2, 760, 'Grau de Automação e Falsos Positivos')
+
+    c.setFont("Helvetica", 9)
+    c.drawString(90, 430, 'Notas:')
+    c.drawString(160, 430, '#Automation(6) = (1)+(3)+(4)')
+    c.drawString(160, 410, '%Automation(7) = #Automation(6)/Total')
+    c.drawString(330, 430, '#FP(8) = (3)+(4)')
+    c.drawString(330, 410, '%FP(9) = #FP(8)/#Automation(6)')
+
+    ###############################################################################
+    # Print Chart #2
+    ###############################################################################
+    draw_chart(c, chart2, 20, 0, 575, 400)
+    ###############################################################################
+    # Print Table #3
+    ###############################################################################
+    t3.drawOn(c, 22, 460)
+    c.showPage()
+
+
+###  Render cache  #####################################################################################################
+
+# charts and tables of the pdf sections kept in --render-cache DIR, one file per entry named by a hash of the data
+# they are drawn from, of their style (the source of this module: colors, fonts, dpi, table styles) and of the
+# versions of the libraries drawing them, an entry is reused as long as none of these changes
+render_version = 1
+with open(__file__, 'rb') as f:
+    style_key = hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+library_versions = '|'.join([matplotlib.__version__, reportlab.Version, np.__version__, pd.__version__])
+
+
+def render_key(kind, data):  # kind: 'raster' or 'vector' chart, or 'tables' of a section
+    h = hashlib.blake2b(digest_size=16)
+    h.update('{}|{}|{}|{}|'.format(render_version, style_key, library_versions, kind).encode())
+    h.update(pickle.dumps(data, protocol=4))
+    return h.hexdigest()
+
+
+def frame_data(df):  # plain lists of a table for render_key, the pickle of a DataFrame depends on how it was built
+    return [list(df.index), list(df.columns), df.astype(object).values.tolist()]
+
+
+def cache_get(cache_dir, key):  # the object of an entry, None when there is none, a hit marks it as used (LRU)
+    path = os.path.join(cache_dir, key + '.pkl')
+    try:
+        with open(path, 'rb') as f:
+            obj = pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError):
+        render_counts['misses'] += 1
+        return None
+    os.utime(path, None)
+    render_counts['hits'] += 1
+    return obj
+
+
+def cache_put(cache_dir, key, obj):  # written next to the entry and renamed, other processes may share the cache
+    if not os.path.exists(cache_dir):
+        os.makedirs(cache_dir, exist_ok=True)
+    path = os.path.join(cache_dir, key + '.pkl')
+    tmp = path + '.tmp{}'.format(os.getpid())
+    with open(tmp, 'wb') as f:
+        pickle.dump(obj, f, protocol=4)
+    os.replace(tmp, path)
+
+
+def evict_render_cache(cache_dir, cap):  # least recently used entries first until the directory fits in cap bytes
+    if not os.path.exists(cache_dir):
+        return
+    entries = sorted((e.stat().st_mtime, e.stat().st_size, e.path) for e in os.scandir(cache_dir)
+                     if e.name.endswith('.pkl'))
+    total = sum(size for used, size, path in entries)
+    for used, size, path in entries:
+        if total <= cap:
+            break
+        try:
+            os.remove(path)
+        except OSError:  # evicted by another process
+            continue
+        total -= size
+        render_counts['evicted'] += 1
+
+
+def cached(cache_dir, keys, make):
+    # objects of the keys, looked up in the cache (None: no cache), the missing ones made all at once by
+    # make(positions) and stored
+    objs = [cache_get(cache_dir, k) for k in keys] if cache_dir else [None] * len(keys)
+    todo = [i for i, obj in enumerate(objs) if obj is None]
+    for i, obj in zip(todo, make(todo) if todo else []):
+        objs[i] = obj
+        if cache_dir:
+            cache_put(cache_dir, keys[i], obj)
+    return objs
+
+
+def write_changed(path, data):  # files of unchanged charts are left alone (and keep their modification time)
+    if os.path.exists(path) and os.path.getsize(path) == len(data):
+        with open(path, 'rb') as f:
+            if f.read() == data:
+                return
+    with open(path, 'wb') as f:
+        f.write(data)
+
+
+def report_sections(report):
+    # (arh, gc1, gc3, title, sweep) of every pdf section: one per dimension, for the global summary and then for
+    # every group
+    arh, gc1, gc2, gc3, sweep = report['tables']
+    sections = [(arh[0], gc1[0], gc3[0], 'CARACTERES', sweep[0]),
+                (arh[1], gc1[1], gc3[1], 'ESTADO', sweep[1]),
+                (arh[2], gc1[2], gc3[2], 'CARACTERES + ESTADO', sweep[2])]
+    for g, (g_arh, g_gc1, g_gc2, g_gc3, g_sweep) in report['groups']:
+        sections += [(g_arh[0], g_gc1[0], g_gc3[0], 'CARACTERES - {}'.format(g), g_sweep[0]),
+                     (g_arh[1], g_gc1[1], g_gc3[1], 'ESTADO - {}'.format(g), g_sweep[1]),
+                     (g_arh[2], g_gc1[2], g_gc3[2], 'CARACTERES + ESTADO - {}'.format(g), g_sweep[2])]
+    return sections
+
+
+def render_sections(sections, opts):
+    # ([chart 1, chart 2], tables) of every section
+    # all the charts are rendered at once, in the worker processes with --jobs, and handed over as png bytes
+    # vector charts are cheap reportlab drawings and are built here
+    # with --render-cache only the charts and tables not in the cache are drawn
+    jobs = []
+    for arh_s, gc_s, inv_s, title_s, sweep_s in sections:
+        jobs += chart_jobs(gc_s, inv_s, title_s, sweep_s)
+
+    def render(todo):  # the charts of the jobs at the positions todo
+        if opts.charts == 'vector':
+            return [vector_chart(jobs[i]) for i in todo]
+        if opts.jobs > 1 and len(todo) > 1:
+            pool = Pool(min(opts.jobs, len(todo)))
+            pngs = pool.map(render_chart, [jobs[i] for i in todo], chunksize=1)
+            pool.close()
+            pool.join()
+            return pngs
+        return [render_chart(jobs[i]) for i in todo]
+
+    cache = opts.render_cache
+    pngs = cached(cache, [render_key(opts.charts, job) if cache else None for job in jobs], render)
+    keys = [render_key('tables', ([frame_data(df) for df in (arh_s, gc_s, inv_s)], opts.ci_level)) if cache else None
+            for arh_s, gc_s, inv_s, title_s, sweep_s in sections]
+    tables = cached(cache, keys, lambda todo: [section_tables(*sections[i][:3], level=opts.ci_level) for i in todo])
+    return [(pngs[2 * i:2 * i + 2], tables[i]) for i in range(len(sections))]
+
+
+def section_job(job):
+    # worker of generator.concurrent_reports: charts and tables of the snapshot of one section of report_sections,
+    # sent back with the render cache counts of the worker
+    snap, opts = job
+    before = dict(render_counts)
+    part = render_sections([pickle.loads(snap)], opts)[0]
+    return part, {k: render_counts[k] - before[k] for k in render_counts}
+
+
+def assemble_pdf(path, sections, parts, opts):
+    # the pdf of the sections, drawn one after the other as parts (an iterable of their charts and tables, see
+    # render_sections) come in
+    c = canvas.Canvas(path, pagesize=A4)
+    charts = []
+    for (arh_s, gc_s, inv_s, title_s, sweep_s), (pair, tables) in zip(sections, parts):
+        create_pdf(c, arh_s, gc_s, inv_s, title_s, pair[0], pair[1], opts.ci_level, tables)
+        charts.append((title_s, pair))
+    c.save()
+
+    if opts.chart_files and opts.charts == 'raster':
+        if not os.path.exists('imgs'):
+            os.makedirs('imgs')
+        for title_s, pair in charts:
+            # group labels may contain characters not allowed in file names
+            fname = re.sub(r'[\\/:*?"<>|]', '_', title_s)
+            for j in range(2):
+                write_changed('imgs/chart{}_{}.png'.format(j + 1, fname), pair[j])
+    if opts.render_cache:
+        evict_render_cache(opts.render_cache, opts.render_cache_size * 2 ** 20)
+
+
+def write_pdf(report, path, opts, metrics=None):
+    sections = report_sections(report)
+    with stage(metrics, 'pdf.charts'):
+        parts = render_sections(sections, opts)
+    with stage(metrics, 'pdf.canvas'):
+        assemble_pdf(path, sections, parts, opts)
+
+
+def diff_cell(column, v):  # text of a cell of the diff tables, deltas signed and percentages with '%'
+    if isinstance(v, float) and np.isnan(v):
+        return ''
+    text = ('{:+}' if column.endswith('B-A') else '{}').format(v)
+    return text + '%' if column.startswith('%') else text
+
+
+def diff_table(df, widths, index=True):  # reportlab Table of a diff table, long headers broken like in create_pdf
+    header = [c.replace('&', '\n').replace('!=', '<>').replace(' ', '\n') for c in df.columns]
+    tabela = [([''] if index else []) + header]
+    for i in range(len(df)):
+        tabela.append(([df.index[i]] if index else []) + [diff_cell(c, df[c].iloc[i]) for c in df.columns])
+    t = Table(tabela, widths)
+    t.setStyle(styleDiff)
+    return t
+
+
+def diff_chart(curve, title, height):  # %Automation and %FP of A and B per GC threshold as reportlab graphics
+    d = Drawing(555, height)
+    fx, fy = vector_frame(d, (-5, 95), (0, 108), 'KPI Automação e FP, A e B - {}'.format(title),
+                          [(e, '{}%'.format(e)) for e in edges], [(y, '{}%'.format(y)) for y in range(0, 101, 10)],
+                          grid=True)
+    items = [('#9CCC65', '%Automation A'), ('#33691E', '%Automation B'), ('#EF9A9A', '%FP A'), ('#B71C1C', '%FP B')]
+    for color, column in items:
+        points = []
+        for x, y in zip(edges, curve[column]):
+            points += [fx(x), fy(y)]
+        d.add(PolyLine(points, strokeColor=colors.HexColor(color), strokeWidth=0.8))
+    vector_box(d)
+    vector_legend(d, [(color, column, 'line') for color, column in items])
+    return d
+
+
+def diff_page(c, diff, n=0):
+    # comparison page of one dimension: changes, transitions, arh and curves of A and B, tables from the top down
+    pwidth, height = A4
+    title = 'DIFF - ' + titles[n]
+    c.setFont("Helvetica", 12)
+    c.drawCentredString(pwidth / 2, 800, title)
+    c.line(pwidth / 2 - c.stringWidth(title, "Helvetica", 12) / 2, 798,
+           pwidth / 2 + c.stringWidth(title, "Helvetica", 12) / 2, 798)
+    c.setFont("Helvetica", 8)
+    c.drawString(40, 780, 'A = {}'.format(diff['files'][0]))
+    c.drawString(40, 769, 'B = {}'.format(diff['files'][1]))
+    c.drawString(40, 758, 'Imagens: {} em A, {} em B, {} em ambos'.format(*diff['images']))
+    tables = [diff_table(diff['changes'].loc[[dimensions[n]]], [60] * len(changes), index=False),
+              diff_table(diff['transitions'][n], [100] + [450 / len(diff['transitions'][n].columns)] *
+                         len(diff['transitions'][n].columns)),
+              diff_table(diff['arh'][n], [100] + [62] * 6),
+              diff_table(diff['curves'][n], [62] * 7, index=False)]
+    y = 745
+    for t in tables:
+        w, h = t.wrap(pwidth, height)
+        y -= h
+        t.drawOn(c, (pwidth - w) / 2, y)
+        y -= 14
+    renderPDF.draw(diff_chart(diff['curves'][n], titles[n], max(y, 150)), c, 20, 0)
+    c.showPage()
+
+
+def write_diff_pdf(diff, path, metrics=None):  # diff pages of a comparison, vector charts only
+    with stage(metrics, 'pdf.canvas'):
+        c = canvas.Canvas(path, pagesize=A4)
+        for n in range(3):
+            diff_page(c, diff, n)
+        c.save()
@@ -0,0 +1,105 @@
+import argparse
+
+import numpy as np  # v 1.14.5
+import pandas as pd  # v 0.23.1
+
+from generator import names
+
+# Synthetic ANPR exports in the 9 column schema of generator.py (img;plate;country;is_ok;plr;ctr;conf3;conf1;conf2)
+# for the benchmarks and the correctness check of bench.py
+
+# benchmark sizes
+sizes = {'100k': 10 ** 5, '1M': 10 ** 6, '10M': 10 ** 7, '100M': 10 ** 8}
+
+chars = np.array(list('ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'))
+# characters an ANPR engine mixes up, most of the misread plates differ from the real one by one of these
+confusable = {'0': 'O', 'O': '0', '1': 'I', 'I': '1', '8': 'B', 'B': '8', '5': 'S', 'S': '5', '2': 'Z', 'Z': '2',
+              '6': 'G', 'G': '6', 'D': '0', 'M': 'N', 'N': 'M', 'U': 'V', 'V': 'U'}
+partner = np.array([np.where(chars == confusable.get(ch, ch))[0][0] for ch in chars])
+countries = np.array(['PT', 'ES', 'FR', 'DE', 'IT', 'NL', 'BE', 'GB', 'PL', 'CH'])
+country_p = [0.55, 0.15, 0.08, 0.06, 0.04, 0.03, 0.03, 0.03, 0.02, 0.01]
+sites = 24
+
+# share of the rows of every outcome
+rates = {'empty': 0.01,  # GT and ARH all N/A, dropped by generator.py
+         'plate_gt_na': 0.03,  # plate N/A, read anyway
+         'plate_not_read': 0.04,  # plate not read (UNK or N/A)
+         'plate_wrong': 0.12,  # plate misread
+         'country_gt_na': 0.02,
+         'country_not_read': 0.03,
+         'country_wrong': 0.06,
+         'not_ok': 0.1}  # is_ok == 0, picture of bad quality
+
+
+def confidences(rs, ok, read, n):
+    # confidence levels in %: high for good reads, spread for misreads, low when nothing was read
+    conf = np.where(ok, rs.beta(9, 1.5, n), rs.beta(4, 3, n))
+    return np.where(read, conf, rs.beta(1.5, 6, n)) * 100
+
+
+def synth_block(rs, start, n, edge_rate=0.001):
+    # DataFrame of n synthetic rows, numbered from start
+    # edge_rate: share of the confidences replaced by bin edges, out of range values or nothing at all
+    r = rs.random_sample((9, n))
+    codes = rs.randint(0, len(chars), (n, 6))
+    plate = chars[codes].view('<U6').ravel()
+    # misreads: one character changed, mostly into its confusable partner
+    wrong = r[0] < rates['plate_wrong']
+    pos = rs.randint(0, 6, n)
+    old = codes[np.arange(n), pos]
+    other = (old + rs.randint(1, len(chars), n)) % len(chars)
+    new = np.where((partner[old] != old) & (r[1] < 0.7), partner[old], other)
+    read_codes = codes.copy()
+    read_codes[wrong, pos[wrong]] = new[wrong]
+    plr = chars[read_codes].view('<U6').ravel().astype(object)
+    plate = plate.astype(object)
+    plate_read = r[2] >= rates['plate_not_read']
+    plr[~plate_read] = np.where(r[3][~plate_read] < 0.5, 'UNK', 'N/A')
+    plate[r[3] < rates['plate_gt_na']] = 'N/A'
+
+    country = countries[rs.choice(len(countries), n, p=country_p)]
+    ctr = np.where(r[4] < rates['country_wrong'], countries[rs.randint(0, len(countries), n)], country).astype(object)
+    country = country.astype(object)
+    country_read = r[5] >= rates['country_not_read']
+    ctr[~country_read] = 'UNK'
+    country[r[6] < rates['country_gt_na']] = 'N/A'
+
+    empty = r[7] < rates['empty']
+    plate[empty], plr[empty], country[empty], ctr[empty] = 'N/A', 'UNK', 'N/A', 'UNK'
+
+    conf1 = confidences(rs, plr == plate, plate_read, n)
+    conf2 = confidences(rs, ctr == country, country_read, n)
+    conf3 = np.clip(np.sqrt(conf1 * conf2) + rs.normal(0, 3, n), 0, 100)
+    conf = np.round(np.stack([conf3, conf1, conf2]), 1)
+    edge = rs.random_sample(conf.shape) < edge_rate
+    conf[edge] = rs.choice([0, 10, 50, 90, 99.9, 100, 100.5, -1, np.nan], edge.sum())
+
+    site = pd.Series(rs.randint(1, sites + 1, n)).astype(str).str.zfill(2)
+    img = 'site' + site + '_' + pd.Series(np.arange(start, start + n)).astype(str).str.zfill(10) + '.jpg'
+    return pd.DataFrame({'img': img.values, 'plate': plate, 'country': country, 'is_ok': (r[8] >= rates['not_ok']) * 1,
+                         'plr': plr, 'ctr': ctr, 'conf3': conf[0], 'conf1': conf[1], 'conf2': conf[2]}, columns=names)
+
+
+def synthesize(path, rows, seed=0, edge_rate=0.001, block=10 ** 6):
+    # writes a CSV of rows synthetic rows block by block, the same seed gives the same file
+    rs = np.random.RandomState(seed)
+    with open(path, 'w') as f:
+        f.write(';'.join(names) + '\n')
+        for start in range(0, rows, block):
+            synth_block(rs, start, min(block, rows - start), edge_rate).to_csv(
+                f, sep=';', header=False, index=False, float_format='%.1f')
+
+
+def parse_rows(text):  # '1M', '100k' or a number of rows
+    return sizes.get(text) or int(float(text))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="synthetic ANPR export in the schema of data_file.csv")
+    parser.add_argument('rows', help="number of rows, or one of " + ', '.join(sizes))
+    parser.add_argument('-o', '--output', default='data_file.csv', metavar='PATH')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--edge-rate', type=float, default=0.001, metavar='RATE',
+                        help="share of the confidences set to bin edges, out of range values or left empty")
+    args = parser.parse_args()
+    synthesize(args.output, parse_rows(args.rows), args.seed, args.edge_rate)